@@ -0,0 +1,141 @@
+"""Benchmark of reading scattered rows with backed access to `.h5ad` files.
+
+Compares :func:`~lamindb.core.storage._backed_access.safer_read_partial`,
+which reads the rows of csr matrices with coalesced slices, with the previous path:
+h5py point selections of sorted unique rows for dense arrays and dataframes
+and `CSRDataset` for csr matrices.
+Dense arrays and dataframes are read with the previous path also by
+`safer_read_partial` and are kept as a reference.
+Generates a synthetic file in a local directory, doesn't need network access.
+
+Run from the repository root with a loaded instance::
+
+    python benchmarks/backed_access.py --output report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import anndata as ad
+import h5py
+import numpy as np
+import pandas as pd
+from anndata._io.specs.registry import read_elem_partial
+from lamindb.core.storage._backed_access import CSRDataset, registry
+from scipy.sparse import random as sparse_random
+
+ELEMS = ("dense", "sparse", "obs")
+
+
+def make_file(path: Path, n_obs: int, n_vars: int, density: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = sparse_random(
+        n_obs, n_vars, density=density, format="csr", dtype=np.float32, random_state=rng
+    )
+    obs = pd.DataFrame(
+        {
+            "cell_type": rng.choice([f"type_{j}" for j in range(20)], n_obs),
+            "n_genes": rng.integers(0, n_vars, n_obs),
+        },
+        index=[f"cell_{i}" for i in range(n_obs)],
+    )
+    adata = ad.AnnData(X=X, obs=obs, layers={"dense": X.toarray()})
+    adata.strings_to_categoricals()
+    adata.write_h5ad(path)
+
+
+def read_previous(elem, rows: np.ndarray):
+    """Read the rows as before the read planner."""
+    sorted_rows, inverse = np.unique(rows, return_inverse=True)
+    if isinstance(elem, h5py.Dataset):
+        return elem[sorted_rows][inverse]
+    if "indptr" in elem:
+        return CSRDataset(elem)[sorted_rows][inverse]
+    return read_elem_partial(elem, indices=(sorted_rows, slice(None))).iloc[inverse]
+
+
+def read_planned(elem, rows: np.ndarray):
+    return registry.safer_read_partial(elem, indices=(rows, slice(None)))
+
+
+def _equal(a, b) -> bool:
+    if isinstance(a, pd.DataFrame):
+        return a.equals(b)
+    if hasattr(a, "toarray"):
+        a, b = a.toarray(), b.toarray()
+    return np.array_equal(a, b)
+
+
+def time_read(read, elem, rows: np.ndarray, repeats: int) -> tuple[float, object]:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = read(elem, rows)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n-obs", type=int, default=100000)
+    parser.add_argument("--n-vars", type=int, default=500)
+    parser.add_argument("--density", type=float, default=0.05)
+    parser.add_argument("--n-rows", nargs="+", type=int, default=[100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--data-dir", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) if args.data_dir is None else args.data_dir
+        path = data_dir / f"backed_{args.n_obs}_{args.n_vars}_{args.density}.h5ad"
+        if not path.exists():
+            make_file(path, args.n_obs, args.n_vars, args.density)
+        with h5py.File(path, mode="r") as file:
+            elems = {
+                "dense": file["layers"]["dense"],
+                "sparse": file["X"],
+                "obs": file["obs"],
+            }
+            for name in ELEMS:
+                for n_rows in args.n_rows:
+                    rows = rng.choice(args.n_obs, n_rows, replace=False)
+                    previous, expected = time_read(
+                        read_previous, elems[name], rows, args.repeats
+                    )
+                    planned, result = time_read(
+                        read_planned, elems[name], rows, args.repeats
+                    )
+                    if not _equal(result, expected):
+                        print(f"{name}/{n_rows}: the results differ")
+                        return 1
+                    results.append(
+                        {
+                            "case": f"{name}/{n_rows}",
+                            "previous_sec": previous,
+                            "planned_sec": planned,
+                            "speedup": previous / planned,
+                        }
+                    )
+                    print(
+                        f"{name}/{n_rows}: {previous:.4f}s before, {planned:.4f}s"
+                        f" planned, {previous / planned:.1f}x"
+                    )
+
+    if args.output is not None:
+        report: dict = {"params": {k: str(v) for k, v in vars(args).items()}}
+        report["results"] = results
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
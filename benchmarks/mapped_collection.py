@@ -0,0 +1,306 @@
+"""Throughput benchmark for :class:`~lamindb.core.MappedCollection`.
+
+Generates synthetic collections of sparse and dense `.h5ad` and `.zarr` files
+in a local directory and measures construction time, single-item and batched
+throughput and the memory of worker processes for variations of
+``parallel``, ``join``, ``dtype`` and the sampler.
+Doesn't need network access, the defaults run in a minute on a laptop.
+
+Run from the repository root with a loaded instance::
+
+    python benchmarks/mapped_collection.py --output report.json
+
+To gate a change, compare with a report of the base branch, the command fails
+if the batched throughput of a case drops by more than ``--tolerance``::
+
+    python benchmarks/mapped_collection.py --output new.json --baseline base.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import anndata as ad
+import lamindb as ln
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+
+FORMATS = ("h5ad", "zarr")
+LAYOUTS = ("sparse", "dense")
+SAMPLERS = ("sequential", "random", "block_shuffle")
+# the keyword arguments of MappedCollection which are benchmarked,
+# every variant changes one of them
+VARIANTS: dict[str, dict] = {
+    "default": {},
+    "join_outer": {"join": "outer"},
+    "dtype_float32": {"dtype": "float32"},
+    "parallel": {"parallel": True},
+}
+
+
+def make_collection(
+    directory: Path,
+    fmt: str,
+    layout: str,
+    n_files: int,
+    n_obs: int,
+    n_vars: int,
+    density: float,
+    seed: int = 0,
+) -> list[str]:
+    """Write a synthetic collection, the variables of the files overlap partially.
+
+    The parameters are stored with the files, a collection in ``directory``
+    is reused only if it was written with the same parameters.
+    """
+    directory = directory / f"{layout}_{fmt}"
+    paths = [str(directory / f"part_{i}.{fmt}") for i in range(n_files)]
+    params = {
+        "n_files": n_files,
+        "n_obs": n_obs,
+        "n_vars": n_vars,
+        "density": density,
+        "seed": seed,
+    }
+    params_path = directory / "params.json"
+    if params_path.exists() and json.loads(params_path.read_text()) == params:
+        return paths
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    rng = np.random.default_rng(seed)
+    genes = np.array([f"gene_{i}" for i in range(n_vars + n_vars // 10)])
+    for i, path in enumerate(paths):
+        X = sparse_random(
+            n_obs,
+            n_vars,
+            density=density,
+            format="csr",
+            dtype=np.float32,
+            random_state=rng,
+        )
+        X.data = np.ceil(X.data * 10)
+        obs = pd.DataFrame(
+            {"cell_type": rng.choice([f"type_{j}" for j in range(20)], n_obs)},
+            index=[f"cell_{i}_{j}" for j in range(n_obs)],
+        )
+        var = pd.DataFrame(index=np.sort(rng.choice(genes, n_vars, replace=False)))
+        adata = ad.AnnData(X=X if layout == "sparse" else X.toarray(), obs=obs, var=var)
+        adata.strings_to_categoricals()
+        if fmt == "h5ad":
+            adata.write_h5ad(path)
+        else:
+            adata.write_zarr(path, chunks=(min(n_obs, 256), n_vars))
+    # written last, so that an interrupted collection is regenerated
+    params_path.write_text(json.dumps(params))
+    return paths
+
+
+def make_batches(
+    mapped, sampler: str, batch_size: int, n_batches: int, seed: int = 0
+) -> list[np.ndarray]:
+    n_obs = min(mapped.n_obs, batch_size * n_batches)
+    if sampler == "sequential":
+        idxs = np.arange(n_obs)
+    elif sampler == "random":
+        idxs = np.random.default_rng(seed).permutation(mapped.n_obs)[:n_obs]
+    else:
+        idxs = np.fromiter(
+            ln.core.BlockShuffleSampler(mapped, seed=seed), dtype=np.int64
+        )[:n_obs]
+    return [idxs[i : i + batch_size] for i in range(0, n_obs, batch_size)]
+
+
+def _rss_mb() -> float | None:
+    """The current resident memory of the process in MB, `None` if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        # not available on Windows
+        import resource
+    except ImportError:
+        return None
+    # the peak instead of the current memory, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def _read_in_worker(mapped, batches, results):
+    for idxs in batches:
+        mapped.get_batch(idxs)
+    results.put(_rss_mb())
+
+
+def worker_memory(mapped, batches: list, n_workers: int) -> float | None:
+    """The maximal memory of ``n_workers`` processes which read the batches in MB."""
+    if n_workers < 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_read_in_worker, args=(mapped, batches[i::n_workers], results)
+        )
+        for i in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    memory = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    measured = [rss for rss in memory if rss is not None]
+    return max(measured) if measured else None
+
+
+def run_case(
+    paths: list[str],
+    kwargs: dict,
+    sampler: str,
+    batch_size: int,
+    n_batches: int,
+    n_items: int,
+    n_workers: int,
+) -> dict:
+    start = time.perf_counter()
+    mapped = ln.core.MappedCollection(paths, obs_keys="cell_type", **kwargs)
+    construction = time.perf_counter() - start
+    try:
+        batches = make_batches(mapped, sampler, batch_size, n_batches)
+        items = np.concatenate(batches)[:n_items]
+        start = time.perf_counter()
+        for idx in items:
+            mapped[int(idx)]
+        items_per_sec = len(items) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for idxs in batches:
+            mapped.get_batch(idxs)
+        n_samples = sum(len(idxs) for idxs in batches)
+        samples_per_sec = n_samples / (time.perf_counter() - start)
+
+        memory = None
+        if kwargs.get("parallel", False):
+            memory = worker_memory(mapped, batches, n_workers)
+    finally:
+        mapped.close()
+    return {
+        "construction_sec": construction,
+        "items_per_sec": items_per_sec,
+        "samples_per_sec": samples_per_sec,
+        "worker_rss_mb": memory,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """The cases with a batched throughput lower than in the baseline."""
+    base = {result["case"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        previous = base.get(result["case"])
+        if previous is None:
+            continue
+        ratio = result["samples_per_sec"] / previous["samples_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result['case']}: {ratio:.2f}x of the baseline")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n-files", type=int, default=4)
+    parser.add_argument("--n-obs", type=int, default=10000)
+    parser.add_argument("--n-vars", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=0.05)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--layouts", nargs="+", default=LAYOUTS, choices=LAYOUTS)
+    parser.add_argument(
+        "--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS)
+    )
+    parser.add_argument("--samplers", nargs="+", default=SAMPLERS, choices=SAMPLERS)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--n-batches", type=int, default=50)
+    parser.add_argument("--n-items", type=int, default=1000)
+    parser.add_argument("--n-workers", type=int, default=2)
+    parser.add_argument("--data-dir", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) if args.data_dir is None else args.data_dir
+        results = []
+        for fmt, layout in itertools.product(args.formats, args.layouts):
+            paths = make_collection(
+                data_dir,
+                fmt,
+                layout,
+                args.n_files,
+                args.n_obs,
+                args.n_vars,
+                args.density,
+            )
+            for variant, sampler in itertools.product(args.variants, args.samplers):
+                case = f"{fmt}/{layout}/{variant}/{sampler}"
+                result = run_case(
+                    paths,
+                    VARIANTS[variant],
+                    sampler,
+                    args.batch_size,
+                    args.n_batches,
+                    args.n_items,
+                    args.n_workers,
+                )
+                results.append({"case": case, **result})
+                print(
+                    f"{case}: {result['samples_per_sec']:.0f} samples/sec, "
+                    f"{result['items_per_sec']:.0f} items/sec"
+                )
+
+    report = {
+        "params": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lamindb": ln.__version__,
+            "anndata": ad.__version__,
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline is not None:
+        regressions = compare(
+            report, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f"regression in {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -36,6 +36,19 @@ Classes:
 
    Settings
    MappedCollection
+   BlockShuffleSampler
+   ClassBalancedSampler
+   ShardSampler
+   PermutationSampler
+   MappedStream
+   ThreadedLoader
+   MappedServer
+   MappedClient
+   NormalizeTotal
+   Log1p
+   Clip
+   AsType
+   Standardize
    run_context
 
 Modules:
@@ -73,5 +86,15 @@ from lamindb.core._label_manager import LabelManager
 
 from . import _data, datasets, exceptions, fields, types
 from ._mapped_collection import MappedCollection
+from ._mapped_loader import ThreadedLoader
+from ._mapped_samplers import (
+    BlockShuffleSampler,
+    ClassBalancedSampler,
+    PermutationSampler,
+    ShardSampler,
+)
+from ._mapped_server import MappedClient, MappedServer
+from ._mapped_stream import MappedStream
+from ._mapped_transforms import AsType, Clip, Log1p, NormalizeTotal, Standardize
 from ._run_context import run_context
 from ._settings import Settings
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+
+class BackedSettings:
+    """Settings for reading cloud files with :meth:`~lamindb.Artifact.backed`.
+
+    Use ``lamindb.settings.backed`` instead of instantiating this class yourself.
+    """
+
+    block_cache: bool = True
+    """Read cloud files through a cache of blocks (default `True`).
+
+    If `False`, every read of an `.h5ad` file is a separate range request
+    and every chunk of a `.zarr` store is requested every time it is read.
+    """
+    block_size: int = 2**20
+    """Number of bytes in a block of an `.h5` or `.h5ad` file (default 1 MiB).
+
+    The blocks are aligned to multiples of the block size.
+    """
+    readahead: int = 4
+    """Number of blocks fetched after the requested blocks (default `4`)."""
+    max_bytes: int = 2**28
+    """Number of bytes of the blocks which are kept in memory (default 256 MiB).
+
+    The least recently used blocks are dropped first.
+    """
+    persist: bool = False
+    """Also write the fetched blocks to the cache directory (default `False`).
+
+    Later sessions read the blocks of unchanged files from there.
+    """
+    max_disk_bytes: int = 2**32
+    """Number of bytes of the blocks which are kept in the cache directory (default 4 GiB).
+
+    Only used if ``persist`` is `True`. The blocks which weren't read
+    for the longest time are removed first.
+    """
+
+
+backed = BackedSettings()
@@ -1,15 +1,35 @@
 from __future__ import annotations
 
-from collections import Counter
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import reduce
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Literal, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 from lamin_utils import logger
-from lamindb_setup.core.upath import UPath
+from lamindb_setup.core.upath import LocalPathClasses, UPath
+from scipy.sparse import csr_matrix
 
+from ._mapped_transforms import _apply_transforms
 from .storage._backed_access import (
     ArrayType,
     ArrayTypes,
@@ -19,6 +39,12 @@ from .storage._backed_access import (
     _safer_read_index,
     registry,
 )
+from .storage._read_plan import (
+    _arange_ranges,
+    _read_csr_rows,
+    _read_ranges,
+    _read_rows,
+)
 
 if TYPE_CHECKING:
     from lamindb_setup.core.types import UPathStr
@@ -48,6 +74,263 @@ class _Connect:
             self.conn.close()
 
 
+# the maximum number of threads to open and read the metadata of the storages
+_MAX_THREADS = 16
+
+# the format of the persisted state, increase if _STATE_ATTRS or their types change
+_STATE_VERSION = 1
+# attributes computed at initialization which can be persisted with state_path
+_STATE_ATTRS = (
+    "n_obs_list",
+    "n_vars_list",
+    "join_vars",
+    "var_joint",
+    "var_indices",
+    "_var_cols",
+    "_cache_cats",
+    "encoders",
+    "_obs_codes",
+    "_obs_decoders",
+)
+
+
+def _map_threads(func, items) -> list:
+    """Apply `func` to `items` concurrently, keeping the order of the results."""
+    items = list(items)
+    if len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), _MAX_THREADS)) as executor:
+        return list(executor.map(func, items))
+
+
+def _min_int_dtype(max_value: int) -> np.dtype:
+    """The narrowest signed integer dtype for values from -1 to `max_value`."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _match_labels(values: np.ndarray, condition) -> np.ndarray:
+    """Evaluate a condition of `obs_filter` for an array of labels."""
+    if callable(condition):
+        return np.asarray(condition(values), dtype=bool)
+    if not isinstance(condition, (list, tuple, set, np.ndarray, pd.Index)):
+        condition = [condition]
+    return pd.Index(values).isin(condition)
+
+
+def _fingerprint(path: UPathStr) -> str:
+    """Identify a file by its path and, if local, by its size and modification time."""
+    path = UPath(path)
+    if isinstance(path, LocalPathClasses):
+        stat = path.stat()
+        return f"{path.as_posix()}:{stat.st_size}:{stat.st_mtime_ns}"
+    return path.as_posix()
+
+
+def _identify_files(
+    path_list: list[UPathStr], hash_list: list[str | None] | None
+) -> list[str]:
+    """Identify the files by their hashes, by their fingerprints if there are none."""
+    if hash_list is None:
+        hash_list = [None] * len(path_list)
+    return [
+        _fingerprint(path) if file_hash is None else file_hash
+        for path, file_hash in zip(path_list, hash_list)
+    ]
+
+
+def _read_ahead(
+    read: Callable, items: Iterable, prefetch: int, n_threads: int
+) -> Iterator:
+    """Apply `read` to the items in a thread pool, at most `prefetch` items ahead.
+
+    The results are returned in the order of the items.
+    The callers validate `prefetch` and `n_threads`.
+    """
+    executor = ThreadPoolExecutor(max_workers=n_threads)
+    pending: deque = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(read, item))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class _HandlePool:
+    """LRU pool of open `.h5ad` files.
+
+    Keeps at most `max_open` files open in a process,
+    closes the least recently used files which are not in use.
+    Handles are dropped after fork or unpickling and reopened lazily.
+    """
+
+    def __init__(self, max_open: int):
+        if max_open < 1:
+            raise ValueError("`max_open_files` should be a positive integer.")
+        self.max_open = max_open
+        self._init_handles()
+
+    def _init_handles(self):
+        # storage_idx -> [conn, store, number of users]
+        self._handles: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        return {"max_open": self.max_open}
+
+    def __setstate__(self, state):
+        self.max_open = state["max_open"]
+        self._init_handles()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @contextmanager
+    def connect(self, storage_idx: int, path: UPath):
+        if self._pid != os.getpid():
+            # can't use the handles of the parent process after fork
+            self._init_handles()
+        with self._lock:
+            if storage_idx in self._handles:
+                handle = self._handles[storage_idx]
+                self._handles.move_to_end(storage_idx)
+            else:
+                handle = [*registry.open("h5py", path), 0]
+                self._handles[storage_idx] = handle
+            handle[2] += 1
+            self._evict()
+        try:
+            yield handle[1]
+        finally:
+            with self._lock:
+                handle[2] -= 1
+                self._evict()
+
+    def _evict(self):
+        for storage_idx in list(self._handles):
+            if len(self._handles) <= self.max_open:
+                break
+            conn, store, n_users = self._handles[storage_idx]
+            if n_users > 0:
+                continue
+            del self._handles[storage_idx]
+            store.close()
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            for conn, store, _ in self._handles.values():
+                store.close()
+                if conn is not None:
+                    conn.close()
+            self._handles.clear()
+
+
+class _ChunkCache:
+    """LRU cache of decompressed chunks bounded by the number of bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._init_chunks()
+
+    def _init_chunks(self):
+        self._chunks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.max_bytes = state["max_bytes"]
+        self._init_chunks()
+
+    def get(self, key: tuple, read):
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks.move_to_end(key)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+        chunk = read()
+        # the chunks are shared between the reads
+        chunk.flags.writeable = False
+        if chunk.nbytes > self.max_bytes:
+            return chunk
+        with self._lock:
+            if key not in self._chunks:
+                self._chunks[key] = chunk
+                self.nbytes += chunk.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._chunks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return chunk
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "n_chunks": len(self._chunks),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self.nbytes = 0
+
+
+class _CachedArray:
+    """Read slices of the first axis of a chunked array through a chunk cache.
+
+    The chunks are the blocks of rows of the chunks along the first axis.
+    """
+
+    def __init__(self, array: ArrayType, cache: _ChunkCache, key: tuple):  # type: ignore
+        self.array = array
+        self.cache = cache
+        self.key = key
+        self.shape = array.shape  # type: ignore
+        self.dtype = array.dtype  # type: ignore
+        self.chunk_rows = array.chunks[0]  # type: ignore
+
+    def _get_chunk(self, chunk_id: int) -> np.ndarray:
+        start = chunk_id * self.chunk_rows
+        return self.cache.get(
+            (*self.key, chunk_id),
+            lambda: self.array[start : start + self.chunk_rows],  # type: ignore
+        )
+
+    def __getitem__(self, key):
+        rows = key[0] if isinstance(key, tuple) else key
+        start, stop, step = rows.indices(self.shape[0])
+        if stop <= start or step != 1:
+            return self.array[key]
+        first, last = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+        chunks = [self._get_chunk(i) for i in range(first, last + 1)]
+        block = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        offset = first * self.chunk_rows
+        result = block[start - offset : stop - offset]
+        if isinstance(key, tuple):
+            result = result[(slice(None), *key[1:])]
+        return result
+
+
 class MappedCollection:
     """Map-style collection for use in data loaders.
 
@@ -63,12 +346,29 @@ class MappedCollection:
     (`.X` is in `"X"`), `obs_keys`, `obsm_keys` (under `f"obsm_{key}"`) and also `"_store_idx"`
     for the index of the `AnnData` object containing this observation sample.
 
+    :meth:`~lamindb.core.MappedCollection.get_batch` takes a list of indices and
+    returns a dictionary with the same keys and arrays with the batch as the first dimension.
+    It reads all rows of an `AnnData` object with coalesced requests
+    and is also used by `torch.utils.data.DataLoader` through `__getitems__`.
+    `__getitem__` with a list of indices also returns a batch, so that a batch sampler
+    can be passed as ``sampler`` with ``batch_size=None`` to `torch.utils.data.DataLoader`.
+
     .. note::
 
         For a guide, see :doc:`docs:scrna5`.
 
         For more convenient use within :class:`~lamindb.core.MappedCollection`,
         see :meth:`~lamindb.Collection.mapped`.
+        The arguments from ``max_open_files`` on are only available here,
+        pass the cached paths and the hashes of the artifacts of a collection::
+
+            artifacts = collection.artifacts.all()
+            mapped = ln.core.MappedCollection(
+                [artifact.cache() for artifact in artifacts],
+                obs_keys="cell_type",
+                state_path="mapped_state.pkl",
+                hash_list=[artifact.hash for artifact in artifacts],
+            )
 
         This currently only works for collections of `AnnData` objects.
 
@@ -89,9 +389,51 @@ class MappedCollection:
         unknown_label: Encode this label to -1.
             Can be a dictionary with keys from ``obs_keys`` if ``encode_labels=True``
             or from ``encode_labels`` if it is a list.
-        cache_categories: Enable caching categories of ``obs_keys`` for faster access.
+        cache_categories: Enable caching categories and integer codes of ``obs_keys``
+            for faster access.
         parallel: Enable sampling with multiple processes.
         dtype: Convert numpy arrays from ``.X``, ``.layers`` and ``.obsm``
+        max_open_files: Keep at most this number of `.h5ad` files open in every process,
+            the least recently used files are closed first. If ``None``, keeps all files open
+            or opens a file for every access if ``parallel=True``.
+        sparse: Return ``.X`` and ``.layers`` as `scipy.sparse.csr_matrix` without densifying,
+            a batch from :meth:`~lamindb.core.MappedCollection.get_batch` is one matrix
+            and a sample is a matrix with one row.
+            Use ``.indptr``, ``.indices`` and ``.data`` to create a sparse csr tensor in `torch`.
+        state_path: A local file to persist the state computed at initialization:
+            shapes, joined variables, categories, encoders and label codes.
+            If the file was written for the same files and arguments, the state is loaded
+            instead of reading all files, otherwise the file is (over)written.
+            Files are identified by their hashes from ``hash_list`` if passed,
+            otherwise by their paths and, if local, by their sizes and modification times.
+        obs_filter: Select observations by their ``.obs`` labels, a dictionary
+            with ``.obs`` keys and the allowed values (a value or a list of values)
+            or functions which take an array of values and return a boolean array.
+            Only the selected observations are indexed, ``.X`` is not read for filtering.
+            For example, ``{"cell_type": ["T cell", "B cell"]}``.
+        var_subset: Return only these variables from ``.X`` and ``.layers``, in this order.
+            Only the columns of these variables are read from dense arrays,
+            the other variables of csr matrices are dropped before densifying.
+            All variables should be in the joined variables.
+        transforms: Transforms which are applied in order to batches and samples
+            from ``.X`` and ``.layers``, for example
+            ``[ln.core.NormalizeTotal(1e4), ln.core.Log1p()]``.
+            The built-in transforms are :class:`~lamindb.core.NormalizeTotal`,
+            :class:`~lamindb.core.Log1p`, :class:`~lamindb.core.Clip`,
+            :class:`~lamindb.core.AsType` and :class:`~lamindb.core.Standardize`.
+            Any function which takes a batch and returns a batch can be a transform,
+            it gets dense arrays unless it has the attribute ``keeps_zeros = True``.
+            Batches from csr matrices stay sparse until the first transform
+            which doesn't keep zeros.
+        chunk_cache_size: Keep decompressed chunks of ``.X``, ``.layers`` and ``.obsm``
+            up to this number of bytes in every process, the least recently used chunks
+            are dropped first. Useful for compressed arrays together with a sampler
+            which returns neighbouring rows, for example
+            :class:`~lamindb.core.BlockShuffleSampler`.
+            See :meth:`~lamindb.core.MappedCollection.chunk_cache_info`.
+        hash_list: Hashes of the files in ``path_list``, for example ``artifact.hash``,
+            which identify the files for ``state_path``. ``None`` elements
+            fall back to the paths.
     """
 
     def __init__(
@@ -106,8 +448,23 @@ class MappedCollection:
         cache_categories: bool = True,
         parallel: bool = False,
         dtype: str | None = None,
+        max_open_files: int | None = None,
+        sparse: bool = False,
+        state_path: UPathStr | None = None,
+        obs_filter: dict[str, Any] | None = None,
+        var_subset: list[str] | None = None,
+        transforms: list | None = None,
+        chunk_cache_size: int | None = None,
+        hash_list: list[str | None] | None = None,
     ):
         assert join in {None, "inner", "outer"}
+        # the state is unpickled, only trust local files
+        if state_path is not None and not isinstance(
+            UPath(state_path), LocalPathClasses
+        ):
+            raise ValueError("`state_path` should be a local path.")
+        if hash_list is not None and len(hash_list) != len(path_list):
+            raise ValueError("`hash_list` should have the same length as `path_list`.")
 
         if layers_keys is None:
             self.layers_keys = ["X"]
@@ -143,74 +500,268 @@ class MappedCollection:
                 )
         self.unknown_label = unknown_label
 
+        self._var_subset = None if var_subset is None else list(var_subset)
+
+        self._transforms = [] if transforms is None else list(transforms)
+        if sparse and not all(
+            getattr(t, "keeps_zeros", False) for t in self._transforms
+        ):
+            raise ValueError(
+                "All `transforms` should keep zeros to return sparse matrices."
+            )
+
         self.storages = []  # type: ignore
         self.conns = []  # type: ignore
         self.parallel = parallel
         self._path_list = path_list
-        self._make_connections(path_list, parallel)
+        self._handles = None if max_open_files is None else _HandlePool(max_open_files)
+        # with the pool, .h5ad files are opened lazily
+        self._make_connections(path_list, parallel or self._handles is not None)
 
-        self.n_obs_list = []
-        for storage in self.storages:
-            with _Connect(storage) as store:
-                X = store["X"]
-                if isinstance(X, ArrayTypes):  # type: ignore
-                    self.n_obs_list.append(X.shape[0])
-                else:
-                    self.n_obs_list.append(X.attrs["shape"][0])
-        self.n_obs = sum(self.n_obs_list)
+        if state_path is None:
+            self._make_state(join, cache_categories)
+        else:
+            files = _identify_files(path_list, hash_list)
+            if not self._load_state(state_path, files, join, cache_categories):
+                self._make_state(join, cache_categories)
+                self._save_state(state_path, files, join, cache_categories)
 
-        self.indices = np.hstack([np.arange(n_obs) for n_obs in self.n_obs_list])
-        self.storage_idx = np.repeat(np.arange(len(self.storages)), self.n_obs_list)
+        self._n_obs_unfiltered = self.n_obs_list
+        # rows of the selected observations within their storages
+        self._obs_rows: np.ndarray | None = None
+        if obs_filter is not None:
+            self._filter_obs(obs_filter)
 
-        self.join_vars = join
-        self.var_indices = None
-        self.var_joint = None
-        self.n_vars_list = None
-        self.n_vars = None
-        if self.join_vars is not None:
-            self._make_join_vars()
-            self.n_vars = len(self.var_joint)
-
-        if self.obs_keys is not None:
-            if cache_categories:
-                self._cache_categories(self.obs_keys)
-            else:
-                self._cache_cats: dict = {}
-            self.encoders: dict = {}
-            if self.encode_labels:
-                self._make_encoders(self.encode_labels)  # type: ignore
+        self.n_obs = sum(self.n_obs_list)
+        # the first index of every storage, indices are located with searchsorted
+        self._obs_offsets = np.zeros(len(self.n_obs_list) + 1, dtype=np.int64)
+        np.cumsum(self.n_obs_list, out=self._obs_offsets[1:])
+        self.n_vars = None if self.var_joint is None else len(self.var_joint)
 
         self._dtype = dtype
+        self.sparse = sparse
+        self._chunk_cache = (
+            None if chunk_cache_size is None else _ChunkCache(chunk_cache_size)
+        )
         self._closed = False
 
     def _make_connections(self, path_list: list, parallel: bool):
-        for path in path_list:
+        def open_path(path):
             path = UPath(path)
             if path.exists() and path.is_file():  # type: ignore
                 if parallel:
-                    conn, storage = None, path
-                else:
-                    conn, storage = registry.open("h5py", path)
-            else:
-                conn, storage = registry.open("zarr", path)
+                    return None, path
+                return registry.open("h5py", path)
+            return registry.open("zarr", path)
+
+        for conn, storage in _map_threads(open_path, path_list):
             self.conns.append(conn)
             self.storages.append(storage)
 
-    def _cache_categories(self, obs_keys: list):
-        self._cache_cats = {}
+    def _make_state(
+        self, join: Literal["inner", "outer"] | None, cache_categories: bool
+    ):
+        """Read shapes, variables and labels of all storages."""
+        if cache_categories and self.obs_keys is not None:
+            labels = self.obs_keys
+        elif isinstance(self.encode_labels, list):
+            labels = self.encode_labels
+        else:
+            labels = []
+        # one pass per storage, the storages are read concurrently
+        read_var = join is not None or self._var_subset is not None
+        metadata = _map_threads(
+            lambda i: self._read_metadata(i, read_var, labels, cache_categories),
+            range(len(self.storages)),
+        )
+        self.n_obs_list = [meta["n_obs"] for meta in metadata]
+
+        self.join_vars = join
+        self.var_indices: list | None = None
+        self.var_joint: pd.Index | None = None
+        self.n_vars_list: list[int] | None = None
+        self._var_cols: list | None = None
+        if read_var:
+            self._make_join_vars([meta["var"] for meta in metadata])
+
+        self._cache_cats: dict = {}
+        self.encoders: dict = {}
+        self._obs_codes: dict = {}
+        self._obs_decoders: dict = {}
+        if self.obs_keys is None:
+            return
+        cats_merge: dict = {}
+        for label in labels:
+            cats_merge[label] = set()
+            for meta in metadata:
+                cats, codes = meta["labels"][label]
+                cats_merge[label].update(np.unique(codes) if cats is None else cats)
+        if cache_categories:
+            self._cache_cats = {
+                label: [meta["labels"][label][0] for meta in metadata]
+                for label in labels
+            }
+        if self.encode_labels:
+            self._make_encoders(self.encode_labels, cats_merge)  # type: ignore
+        if cache_categories:
+            codes_list = {
+                label: [meta["labels"][label][1] for meta in metadata]
+                for label in labels
+            }
+            self._cache_codes(labels, codes_list, cats_merge)
+
+    def _read_metadata(
+        self, storage_idx: int, read_var: bool, labels: list, read_codes: bool
+    ) -> dict:
+        """Read the shape, variables and labels of a storage.
+
+        The categories and codes are decoded. The codes are read only if
+        `read_codes` is `True` or if the labels are not categorical,
+        in this case without `read_codes` only the unique labels are kept.
+        """
         decode = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)
-        for label in obs_keys:
-            self._cache_cats[label] = []
-            for storage in self.storages:
-                with _Connect(storage) as store:
-                    cats = self._get_categories(store, label)
-                    if cats is not None:
-                        cats = decode(cats) if isinstance(cats[0], bytes) else cats[...]
-                    self._cache_cats[label].append(cats)
-
-    def _make_encoders(self, encode_labels: list):
+        meta: dict = {"labels": {}}
+        with self._connect(storage_idx) as store:
+            X = store["X"]
+            if isinstance(X, ArrayTypes):  # type: ignore
+                meta["n_obs"] = X.shape[0]
+            else:
+                meta["n_obs"] = X.attrs["shape"][0]
+            if read_var:
+                meta["var"] = _safer_read_index(store["var"])
+            for label in labels:
+                cats = self._get_categories(store, label)
+                codes = None
+                if cats is not None:
+                    cats = decode(cats) if isinstance(cats[0], bytes) else cats[...]
+                if cats is None or read_codes:
+                    codes = self._get_codes(store, label)
+                if cats is None:
+                    codes = decode(codes) if isinstance(codes[0], bytes) else codes
+                    if not read_codes:
+                        codes = np.unique(codes)
+                meta["labels"][label] = (cats, codes)
+        return meta
+
+    def _filter_obs(self, obs_filter: dict):
+        masks = _map_threads(
+            lambda i: self._get_obs_mask(i, obs_filter), range(len(self.storages))
+        )
+        rows_list = [np.flatnonzero(mask) for mask in masks]
+        self.n_obs_list = [len(rows) for rows in rows_list]
+        rows = np.concatenate(rows_list) if rows_list else np.empty(0, dtype=np.int64)
+        self._obs_rows = rows.astype(_min_int_dtype(max(self._n_obs_unfiltered)))
+
+    def _get_obs_mask(self, storage_idx: int, obs_filter: dict) -> np.ndarray:
+        """Evaluate `obs_filter` for the observations of a storage.
+
+        The conditions are evaluated on the categories or the unique labels
+        and then mapped to the observations with the codes.
+        """
+        decode = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)
+        mask = np.ones(self._n_obs_unfiltered[storage_idx], dtype=bool)
+        with self._connect(storage_idx) as store:
+            for label_key, condition in obs_filter.items():
+                if label_key in self._obs_codes:
+                    # the unknown label is encoded to -1, which is the last element
+                    table = _match_labels(self._obs_decoders[label_key], condition)
+                    mask &= table[self._obs_codes[label_key][storage_idx]]
+                    continue
+                codes = self._get_codes(store, label_key)
+                cats = self._get_categories(store, label_key)
+                if cats is None:
+                    cats, codes = np.unique(codes, return_inverse=True)
+                    if len(cats) > 0 and isinstance(cats[0], bytes):
+                        cats = decode(cats)
+                    table = _match_labels(cats, condition)
+                else:
+                    cats = decode(cats) if isinstance(cats[0], bytes) else cats[...]
+                    # missing values have the code -1
+                    table = np.append(_match_labels(cats, condition), False)
+                mask &= table[codes]
+        return mask
+
+    def _filter_rows(self, arrays: list) -> list:
+        """Select the rows of the selected observations from per-storage arrays."""
+        if self._obs_rows is None:
+            return arrays
+        rows_list = np.split(self._obs_rows, self._obs_offsets[1:-1])
+        return [array[rows] for array, rows in zip(arrays, rows_list)]
+
+    def _state_key(
+        self,
+        files: list[str],
+        join: Literal["inner", "outer"] | None,
+        cache_categories: bool,
+    ) -> str:
+        """Hash of the files and the arguments which determine the state."""
+        key = {
+            "version": _STATE_VERSION,
+            "files": files,
+            "obs_keys": self.obs_keys,
+            "join": join,
+            "encode_labels": self.encode_labels,
+            "unknown_label": self.unknown_label,
+            "cache_categories": cache_categories,
+            "var_subset": self._var_subset,
+        }
+        key_str = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
+    def _load_state(
+        self,
+        state_path: UPathStr,
+        files: list[str],
+        join: Literal["inner", "outer"] | None,
+        cache_categories: bool,
+    ) -> bool:
+        state_path = UPath(state_path)
+        if not state_path.exists():
+            return False
+        try:
+            with state_path.open("rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.info(f"can't read the state in {state_path}, recomputing: {e}")
+            return False
+        if (
+            not isinstance(state, dict)
+            or state.get("key") != self._state_key(files, join, cache_categories)
+            or not all(attr in state for attr in _STATE_ATTRS)
+        ):
+            logger.info(f"the state in {state_path} is outdated, recomputing")
+            return False
+        for attr in _STATE_ATTRS:
+            setattr(self, attr, state[attr])
+        return True
+
+    def _save_state(
+        self,
+        state_path: UPathStr,
+        files: list[str],
+        join: Literal["inner", "outer"] | None,
+        cache_categories: bool,
+    ):
+        state = {attr: getattr(self, attr) for attr in _STATE_ATTRS}
+        state["key"] = self._state_key(files, join, cache_categories)
+        state_path = UPath(state_path)
+        # write to a temporary file first because several processes
+        # can initialize the same collection at the same time
+        tmp_path = state_path.with_name(f"{state_path.name}.{os.getpid()}.tmp")
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open("wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(state_path)
+
+    def _connect(self, storage_idx: int):
+        storage = self.storages[storage_idx]
+        if self._handles is not None and isinstance(storage, UPath):
+            return self._handles.connect(storage_idx, storage)
+        return _Connect(storage)
+
+    def _make_encoders(self, encode_labels: list, cats_merge: dict):
         for label in encode_labels:
-            cats = self.get_merged_categories(label)
+            cats = cats_merge[label].copy()
             encoder = {}
             if isinstance(self.unknown_label, dict):
                 unknown_label = self.unknown_label.get(label, None)
@@ -222,22 +773,39 @@ class MappedCollection:
             encoder.update({cat: i for i, cat in enumerate(cats)})
             self.encoders[label] = encoder
 
-    def _make_join_vars(self):
-        var_list = []
-        self.n_vars_list = []
-        for storage in self.storages:
-            with _Connect(storage) as store:
-                vars = _safer_read_index(store["var"])
-                var_list.append(vars)
-                self.n_vars_list.append(len(vars))
+    def _cache_codes(self, obs_keys: list, codes_list: dict, cats_merge: dict):
+        """Map the labels of every storage to int32 codes.
+
+        The codes are the encoder values for encoded labels and the indices
+        of the merged categories otherwise.
+        """
+        for label in obs_keys:
+            if label in self.encoders:
+                encoder = self.encoders[label]
+                # the unknown label is encoded to -1, which is the last element
+                decoder = np.empty(len(encoder), dtype=object)
+                decoder[list(encoder.values())] = list(encoder.keys())
+            else:
+                encoder = {cat: i for i, cat in enumerate(cats_merge[label])}
+                decoder = np.empty(len(encoder), dtype=object)
+                decoder[:] = list(encoder)
+            self._obs_decoders[label] = decoder
+            self._obs_codes[label] = []
+            for i, codes in enumerate(codes_list[label]):
+                cats = self._cache_cats[label][i]
+                if cats is None:
+                    cats, codes = np.unique(codes, return_inverse=True)
+                table = np.array([encoder[cat] for cat in cats], dtype=np.int32)
+                self._obs_codes[label].append(table[codes])
+
+    def _make_join_vars(self, var_list: list):
+        self.n_vars_list = [len(vrs) for vrs in var_list]
 
         vars_eq = all(var_list[0].equals(vrs) for vrs in var_list[1:])
         if vars_eq:
             self.join_vars = None
             self.var_joint = var_list[0]
-            return
-
-        if self.join_vars == "inner":
+        elif self.join_vars == "inner":
             self.var_joint = reduce(pd.Index.intersection, var_list)
             if len(self.var_joint) == 0:
                 raise ValueError(
@@ -248,6 +816,39 @@ class MappedCollection:
         elif self.join_vars == "outer":
             self.var_joint = reduce(pd.Index.union, var_list)
             self.var_indices = [self.var_joint.get_indexer(vrs) for vrs in var_list]
+        else:
+            raise ValueError(
+                "The provided AnnData objects have different variables.\n"
+                "Use join='inner' or join='outer'."
+            )
+
+        dtype = _min_int_dtype(max(self.n_vars_list + [len(self.var_joint)]))
+        if self._var_subset is not None:
+            self._make_var_subset(var_list, dtype)
+        elif self.var_indices is not None:
+            self.var_indices = [idxs.astype(dtype) for idxs in self.var_indices]
+
+    def _make_var_subset(self, var_list: list, dtype: np.dtype):
+        var_subset = pd.Index(self._var_subset)
+        if not var_subset.is_unique:
+            raise ValueError("`var_subset` should not contain duplicates.")
+        missing = var_subset.difference(self.var_joint)
+        if len(missing) > 0:
+            raise ValueError(
+                f"{len(missing)} variables of `var_subset` are not in the joined "
+                f"variables, for example {missing[:5].tolist()}."
+            )
+        self.var_joint = var_subset
+        # only the columns of the subset are read,
+        # they are placed into the subset as for an outer join
+        self.join_vars = "outer"
+        self.var_indices = []
+        self._var_cols = []
+        for vrs in var_list:
+            var_map = var_subset.get_indexer(vrs)
+            cols = np.flatnonzero(var_map >= 0)
+            self._var_cols.append(cols.astype(dtype))
+            self.var_indices.append(var_map[cols].astype(dtype))
 
     def __len__(self):
         return self.n_obs
@@ -257,6 +858,29 @@ class MappedCollection:
         """Shape of the (virtually aligned) dataset."""
         return (self.n_obs, self.n_vars)
 
+    @property
+    def indices(self) -> np.ndarray:
+        """Indices of all observations within their `AnnData` objects."""
+        return self._locate(np.arange(self.n_obs))[1]
+
+    @property
+    def storage_idx(self) -> np.ndarray:
+        """Indices of the `AnnData` objects of all observations."""
+        return np.repeat(np.arange(len(self.n_obs_list)), self.n_obs_list)
+
+    def _locate(self, idxs: int | list[int] | np.ndarray):
+        """Get the storage indices and the indices within the storages."""
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if idxs.size > 0 and (idxs.min() < -self.n_obs or idxs.max() >= self.n_obs):
+            raise IndexError(
+                f"index out of bounds for the collection with {self.n_obs} observations"
+            )
+        idxs = np.where(idxs < 0, idxs + self.n_obs, idxs)
+        storage_idxs = np.searchsorted(self._obs_offsets, idxs, side="right") - 1
+        if self._obs_rows is not None:
+            return storage_idxs, self._obs_rows[idxs].astype(np.int64)
+        return storage_idxs, idxs - self._obs_offsets[storage_idxs]
+
     @property
     def original_shapes(self):
         """Shapes of the underlying AnnData objects."""
@@ -264,17 +888,25 @@ class MappedCollection:
             n_vars_list = [None] * len(self.n_obs_list)
         else:
             n_vars_list = self.n_vars_list
-        return list(zip(self.n_obs_list, n_vars_list))
+        return list(zip(self._n_obs_unfiltered, n_vars_list))
 
-    def __getitem__(self, idx: int):
-        obs_idx = self.indices[idx]
-        storage_idx = self.storage_idx[idx]
+    def __getitem__(self, idx: int | list[int] | np.ndarray):
+        if isinstance(idx, (list, np.ndarray)):
+            return self.get_batch(idx)
+        if (
+            self.sparse
+            or self._var_cols is not None
+            or self._transforms
+            or self._chunk_cache is not None
+        ):
+            return self.__getitems__([idx])[0]
+        storage_idx, obs_idx = (int(i) for i in self._locate(idx))
         if self.var_indices is not None:
             var_idxs_join = self.var_indices[storage_idx]
         else:
             var_idxs_join = None
 
-        with _Connect(self.storages[storage_idx]) as store:
+        with self._connect(storage_idx) as store:
             out = {}
             for layers_key in self.layers_keys:
                 lazy_data = (
@@ -290,6 +922,12 @@ class MappedCollection:
             out["_store_idx"] = storage_idx
             if self.obs_keys is not None:
                 for label in self.obs_keys:
+                    if label in self._obs_codes:
+                        code = self._obs_codes[label][storage_idx][obs_idx]
+                        if label not in self.encoders:
+                            code = self._obs_decoders[label][code]
+                        out[label] = code
+                        continue
                     if label in self._cache_cats:
                         cats = self._cache_cats[label][storage_idx]
                         if cats is None:
@@ -302,6 +940,291 @@ class MappedCollection:
                     out[label] = label_idx
         return out
 
+    def __getitems__(self, idxs: list[int]) -> list[dict]:
+        """Get the samples for a list of indices.
+
+        Used by `torch.utils.data.DataLoader` to fetch all samples of a batch at once,
+        the samples are the same as from `__getitem__` but read with :meth:`get_batch`.
+        """
+        batch = self.get_batch(idxs)
+        return [
+            {key: value[i] for key, value in batch.items()} for i in range(len(idxs))
+        ]
+
+    def get_batch(self, idxs: list[int] | np.ndarray) -> dict:
+        """Get a batch of samples for a list of indices.
+
+        The indices are grouped by the underlying `AnnData` objects and sorted,
+        the rows of each `AnnData` object are read with coalesced slices.
+        Returns a dictionary with the same keys as `__getitem__`,
+        the values are arrays with the batch as the first dimension.
+        """
+        return self._get_batch(idxs, self._connect)
+
+    def _get_batch(self, idxs: list[int] | np.ndarray, connect: Callable) -> dict:
+        """Get a batch, open the storages with `connect`."""
+        storage_idxs, obs_idxs = self._locate(idxs)
+
+        obsm_keys = [] if self.obsm_keys is None else self.obsm_keys
+        obs_keys = [] if self.obs_keys is None else self.obs_keys
+        pieces: dict = {key: [] for key in self.layers_keys}
+        for obsm_key in obsm_keys:
+            pieces[f"obsm_{obsm_key}"] = []
+        labels = {}
+        for label in obs_keys:
+            dtype = np.int32 if label in self._obs_codes else object
+            labels[label] = np.empty(len(idxs), dtype=dtype)
+
+        order = np.argsort(storage_idxs, kind="stable")
+        bounds = np.flatnonzero(np.diff(storage_idxs[order])) + 1
+        for pos in np.split(order, bounds):
+            # an empty batch reads zero rows of the first storage
+            # to get the dtypes and the shapes
+            storage_idx = storage_idxs[pos[0]] if len(pos) > 0 else 0
+            rows, inverse = np.unique(obs_idxs[pos], return_inverse=True)
+            with connect(storage_idx) as store:
+                for layers_key in self.layers_keys:
+                    lazy_data = (
+                        store["X"] if layers_key == "X" else store["layers"][layers_key]
+                    )
+                    cols = (
+                        None if self._var_cols is None else self._var_cols[storage_idx]
+                    )
+                    data = self._get_data_idxs(
+                        lazy_data, rows, cols, (storage_idx, f"layers/{layers_key}")
+                    )
+                    pieces[layers_key].append((pos, inverse, storage_idx, data))
+                for obsm_key in obsm_keys:
+                    data = self._get_data_idxs(
+                        store["obsm"][obsm_key],
+                        rows,
+                        None,
+                        (storage_idx, f"obsm/{obsm_key}"),
+                    )
+                    pieces[f"obsm_{obsm_key}"].append((pos, inverse, storage_idx, data))
+                for label in obs_keys:
+                    if label in self._obs_codes:
+                        codes = self._obs_codes[label][storage_idx]
+                        labels[label][pos] = codes[obs_idxs[pos]]
+                        continue
+                    if label in self._cache_cats:
+                        cats = self._cache_cats[label][storage_idx]
+                        if cats is None:
+                            cats = []
+                    else:
+                        cats = None
+                    label_idxs = self._get_obs_idxs(store, rows, label, cats)
+                    labels[label][pos] = label_idxs[inverse]
+
+        out = {}
+        for key, key_pieces in pieces.items():
+            layer = key in self.layers_keys
+            if not layer or not self._transforms:
+                out[key] = self._assemble_batch(
+                    key_pieces, len(idxs), layer, self.sparse
+                )
+                continue
+            # the transforms run on the csr matrix before densifying if possible
+            as_csr = self.sparse or all(isinstance(p[3], tuple) for p in key_pieces)
+            X = self._assemble_batch(key_pieces, len(idxs), layer, as_csr)
+            out[key] = _apply_transforms(X, self._transforms, dense=not self.sparse)
+        out["_store_idx"] = storage_idxs
+        for label in obs_keys:
+            if label in self._obs_codes:
+                if label in self.encoders:
+                    out[label] = labels[label]
+                else:
+                    out[label] = self._obs_decoders[label][labels[label]]
+            elif label in self.encoders:
+                encoder = self.encoders[label]
+                out[label] = np.array(
+                    [encoder[value] for value in labels[label]], dtype=int
+                )
+            else:
+                out[label] = labels[label]
+        return out
+
+    def iter_batches(
+        self, batches: Iterable, prefetch: int = 2, n_threads: int = 2
+    ) -> Iterator[dict]:
+        """Iterate over batches which are read ahead in background threads.
+
+        The batches are read with :meth:`~lamindb.core.MappedCollection.get_batch`
+        in a thread pool while the previous batches are used, so that the reads
+        overlap with training. At most ``prefetch`` batches are read ahead,
+        which bounds the memory. The batches are returned in the order of ``batches``.
+
+        Args:
+            batches: Lists of indices, for example a
+                `torch.utils.data.BatchSampler` with one of the samplers.
+            prefetch: The number of batches which are read ahead.
+            n_threads: The number of threads which read the batches.
+
+        Examples:
+            >>> from torch.utils.data import BatchSampler
+            >>> sampler = ln.core.BlockShuffleSampler(mapped)
+            >>> batches = BatchSampler(sampler, batch_size=256, drop_last=False)
+            >>> for batch in mapped.iter_batches(batches, prefetch=4):
+            >>>     ...
+        """
+        if prefetch < 1 or n_threads < 1:
+            raise ValueError("`prefetch` and `n_threads` should be positive.")
+        return _read_ahead(self.get_batch, batches, prefetch, n_threads)
+
+    def _get_data_idxs(
+        self,
+        lazy_data: ArrayType | GroupType,  # type: ignore
+        idxs: np.ndarray,
+        cols: np.ndarray | None = None,
+        cache_key: tuple | None = None,
+    ):
+        """Get the data for sorted unique indices.
+
+        Returns a dense array or a tuple `(data, indices, indptr, n_vars)`
+        for a csr matrix. If `cols` is passed, only these columns are returned
+        and the columns are numbered by their positions in `cols`.
+        The chunks are cached under `cache_key` if the chunk cache is enabled.
+        """
+        if isinstance(lazy_data, ArrayTypes):  # type: ignore
+            return _read_rows(self._cached(lazy_data, cache_key), idxs, cols)
+        else:  # assume csr_matrix here
+            data, indices, indptr = _read_csr_rows(
+                self._cached(lazy_data["indptr"], cache_key, "indptr"),  # type: ignore
+                self._cached(lazy_data["data"], cache_key, "data"),  # type: ignore
+                self._cached(lazy_data["indices"], cache_key, "indices"),  # type: ignore
+                idxs,
+            )
+            n_vars = lazy_data.attrs["shape"][1]  # type: ignore
+            if cols is None:
+                return data, indices, indptr, n_vars
+            col_map = np.full(n_vars, -1, dtype=np.int64)
+            col_map[cols] = np.arange(len(cols))
+            indices = col_map[indices]
+            keep = indices >= 0
+            n_kept = np.zeros(len(keep) + 1, dtype=np.int64)
+            np.cumsum(keep, out=n_kept[1:])
+            return data[keep], indices[keep], n_kept[indptr], len(cols)
+
+    def _cached(
+        self,
+        array: ArrayType,  # type: ignore
+        cache_key: tuple | None,
+        name: str | None = None,
+    ):
+        """Read the array through the chunk cache if it is enabled and the array is chunked."""
+        if self._chunk_cache is None or cache_key is None or array.chunks is None:  # type: ignore
+            return array
+        storage_idx, key = cache_key
+        if name is not None:
+            key = f"{key}/{name}"
+        return _CachedArray(array, self._chunk_cache, (storage_idx, key))
+
+    def chunk_cache_info(self) -> dict | None:
+        """Statistics of the chunk cache of this process.
+
+        Returns a dictionary with the numbers of cache `"hits"` and `"misses"`,
+        the number of cached chunks `"n_chunks"`, their size `"nbytes"`
+        and `"max_bytes"`, or ``None`` if ``chunk_cache_size`` wasn't passed.
+        """
+        if self._chunk_cache is None:
+            return None
+        return self._chunk_cache.info()
+
+    def _get_var_map(self, storage_idx: int):
+        """Map variables of the storage to the joint variables, -1 if not present."""
+        var_idxs_join = self.var_indices[storage_idx]
+        if self.join_vars == "outer":
+            return var_idxs_join
+        var_map = np.full(self.n_vars_list[storage_idx], -1, dtype=np.int64)
+        var_map[var_idxs_join] = np.arange(len(var_idxs_join))
+        return var_map
+
+    def _assemble_batch(
+        self, pieces: list, n_batch: int, layer: bool, sparse: bool = False
+    ):
+        """Scatter the data of all storages into one preallocated array.
+
+        Returns a csr matrix for layers if `sparse=True`.
+        """
+        dtypes, shapes = [], []
+        for _, _, _, data in pieces:
+            if isinstance(data, tuple):
+                dtypes.append(data[0].dtype)
+                shapes.append((data[3],))
+            else:
+                dtypes.append(data.dtype)
+                shapes.append(data.shape[1:])
+        dtype = np.result_type(*dtypes) if self._dtype is None else self._dtype
+
+        join_vars = layer and self.var_indices is not None
+        if join_vars:
+            shape = (n_batch, self.n_vars)
+        elif all(shape == shapes[0] for shape in shapes[1:]):
+            shape = (n_batch, *shapes[0])
+        else:
+            raise ValueError(
+                "The AnnData objects have different numbers of variables, use join."
+            )
+
+        if layer and sparse:
+            coo = [
+                self._get_coo(pos, inverse, storage_idx, data, join_vars)
+                for pos, inverse, storage_idx, data in pieces
+            ]
+            rows, cols, values = (np.concatenate(arrays) for arrays in zip(*coo))
+            values = values.astype(dtype, copy=False)
+            return csr_matrix((values, (rows, cols)), shape=shape)
+
+        # zeros are needed for sparse data and outer joins
+        out = np.zeros(shape, dtype=dtype)
+        for pos, inverse, storage_idx, data in pieces:
+            if isinstance(data, tuple):
+                rows, cols, values = self._get_coo(
+                    pos, inverse, storage_idx, data, join_vars
+                )
+                out[rows, cols] = values
+            else:
+                data = data[inverse]
+                if not join_vars:
+                    out[pos] = data
+                elif self.join_vars == "outer":
+                    out[np.ix_(pos, self.var_indices[storage_idx])] = data
+                else:  # inner join
+                    out[pos] = data[:, self.var_indices[storage_idx]]
+        return out
+
+    def _get_coo(
+        self,
+        pos: np.ndarray,
+        inverse: np.ndarray,
+        storage_idx: int,
+        data: np.ndarray | tuple,
+        join_vars: bool,
+    ):
+        """Get rows, columns and values of the nonzero elements in the batch.
+
+        The joins are applied by remapping the columns.
+        """
+        if isinstance(data, tuple):
+            data, indices, indptr, _ = data
+            # expand the unique rows to their positions in the batch
+            row_lengths = np.diff(indptr)[inverse]
+            gather = _arange_ranges(indptr[:-1][inverse], row_lengths)
+            rows = np.repeat(pos, row_lengths)
+            cols = indices[gather]
+            values = data[gather]
+        else:
+            dense = data[inverse]
+            rows, cols = np.nonzero(dense)
+            values = dense[rows, cols]
+            rows = pos[rows]
+        if join_vars:
+            cols = self._get_var_map(storage_idx)[cols]
+            if self.join_vars == "inner":
+                mask = cols >= 0
+                rows, cols, values = rows[mask], cols[mask], values[mask]
+        return rows, cols, values
+
     def _get_data_idx(
         self,
         lazy_data: ArrayType | GroupType,  # type: ignore
@@ -371,29 +1294,78 @@ class MappedCollection:
             label = label.decode("utf-8")
         return label
 
+    def _get_obs_idxs(
+        self,
+        storage: StorageType,
+        idxs: np.ndarray,
+        label_key: str,
+        categories: list | None = None,
+    ):
+        """Get the labels for sorted unique indices by key."""
+        obs = storage["obs"]  # type: ignore
+        if isinstance(obs, ArrayTypes):  # type: ignore
+            labels = _read_ranges(obs, idxs, idxs + 1)[label_key]
+        else:
+            labels = obs[label_key]
+            if not isinstance(labels, ArrayTypes):  # type: ignore
+                labels = labels["codes"]
+            labels = _read_ranges(labels, idxs, idxs + 1)
+        if categories is not None:
+            cats = categories
+        else:
+            cats = self._get_categories(storage, label_key)
+        if cats is not None and len(cats) > 0:
+            labels = np.asarray(cats)[labels]
+        if len(labels) > 0 and isinstance(labels[0], bytes):
+            labels = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)(labels)
+        return labels
+
     def get_label_weights(self, obs_keys: str | list[str]):
-        """Get all weights for the given label keys."""
+        """Get all weights for the given label keys.
+
+        The weight of an observation is the inverse of the number of observations
+        with the same labels for all `obs_keys`.
+        """
+        codes, _ = self._get_label_groups(obs_keys)
+        return 1.0 / np.bincount(codes)[codes]
+
+    def _get_label_groups(self, obs_keys: str | list[str]):
+        """Get codes of the combined labels of all observations and their number."""
         if isinstance(obs_keys, str):
             obs_keys = [obs_keys]
-        labels_list = []
-        for label_key in obs_keys:
-            labels_to_str = self.get_merged_labels(label_key).astype(str).astype("O")
-            labels_list.append(labels_to_str)
-        if len(labels_list) > 1:
-            labels = reduce(lambda a, b: a + b, labels_list)
-        else:
-            labels = labels_list[0]
-        labels = self.get_merged_labels(label_key)
-        counter = Counter(labels)  # type: ignore
-        weights = 1.0 / np.array([counter[label] for label in labels])
-        return weights
+        combined, n_combined = self._get_label_codes(obs_keys[0])
+        for label_key in obs_keys[1:]:
+            codes, n_codes = self._get_label_codes(label_key)
+            # keep the combined codes small to avoid overflows
+            if n_combined * n_codes > self.n_obs:
+                uniques, combined = np.unique(combined, return_inverse=True)
+                n_combined = len(uniques)
+            combined = combined * n_codes + codes
+            n_combined *= n_codes
+        if n_combined > self.n_obs:
+            uniques, combined = np.unique(combined, return_inverse=True)
+            n_combined = len(uniques)
+        return combined, n_combined
+
+    def _get_label_codes(self, label_key: str):
+        """Get non-negative integer codes of the merged labels and their number."""
+        if label_key in self._obs_codes:
+            # shift by one because the unknown label is encoded to -1
+            codes = np.concatenate(self._filter_rows(self._obs_codes[label_key]))
+            codes = codes.astype(np.int64) + 1
+            return codes, len(self._obs_decoders[label_key]) + 1
+        codes, uniques = pd.factorize(self.get_merged_labels(label_key))
+        return codes.astype(np.int64) + 1, len(uniques) + 1
 
     def get_merged_labels(self, label_key: str):
         """Get merged labels for `label_key` from all `.obs`."""
+        if label_key in self._obs_codes:
+            codes = np.concatenate(self._filter_rows(self._obs_codes[label_key]))
+            return self._obs_decoders[label_key][codes]
         labels_merge = []
         decode = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)
-        for i, storage in enumerate(self.storages):
-            with _Connect(storage) as store:
+        for i in range(len(self.storages)):
+            with self._connect(i) as store:
                 codes = self._get_codes(store, label_key)
                 labels = decode(codes) if isinstance(codes[0], bytes) else codes
                 if label_key in self._cache_cats:
@@ -404,14 +1376,14 @@ class MappedCollection:
                     cats = decode(cats) if isinstance(cats[0], bytes) else cats
                     labels = cats[labels]
                 labels_merge.append(labels)
-        return np.hstack(labels_merge)
+        return np.hstack(self._filter_rows(labels_merge))
 
     def get_merged_categories(self, label_key: str):
         """Get merged categories for `label_key` from all `.obs`."""
         cats_merge = set()
         decode = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)
-        for i, storage in enumerate(self.storages):
-            with _Connect(storage) as store:
+        for i in range(len(self.storages)):
+            with self._connect(i) as store:
                 if label_key in self._cache_cats:
                     cats = self._cache_cats[label_key][i]
                 else:
@@ -458,7 +1430,7 @@ class MappedCollection:
         """Get codes."""
         obs = storage["obs"]  # type: ignore
         if isinstance(obs, ArrayTypes):  # type: ignore
-            label = obs[label_key]
+            return obs[label_key]
         else:
             label = obs[label_key]
             if isinstance(label, ArrayTypes):  # type: ignore
@@ -469,8 +1441,12 @@ class MappedCollection:
     def close(self):
         """Close connections to array streaming backend.
 
-        No effect if `parallel=True`.
+        No effect if `parallel=True` and `max_open_files=None`.
         """
+        if self._handles is not None:
+            self._handles.close()
+        if self._chunk_cache is not None:
+            self._chunk_cache.clear()
         for storage in self.storages:
             if hasattr(storage, "close"):
                 storage.close()
@@ -502,6 +1478,9 @@ class MappedCollection:
         from torch.utils.data import get_worker_info
 
         mapped = get_worker_info().dataset
+        if mapped._handles is not None:
+            # files are opened lazily in every worker
+            return
         mapped.parallel = False
         mapped.storages = []
         mapped.conns = []
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+import numpy as np
+from lamin_utils import logger
+from lamindb_setup.core.upath import UPath
+
+from ._mapped_collection import _Connect, _read_ahead
+from .storage._backed_access import registry
+
+if TYPE_CHECKING:
+    from ._mapped_collection import MappedCollection
+
+
+def _zarr_storage_idxs(mapped: MappedCollection) -> set[int]:
+    try:
+        import zarr
+    except ImportError:
+        return set()
+    return {
+        storage_idx
+        for storage_idx, storage in enumerate(mapped.storages)
+        if isinstance(storage, zarr.Group)
+    }
+
+
+class ThreadedLoader:
+    """Load batches of a zarr-backed :class:`~lamindb.core.MappedCollection` in threads.
+
+    An alternative to `torch.utils.data.DataLoader` with worker processes,
+    which each hold a copy of the indices and caches of `mapped`.
+    Here, the batches are read by a pool of threads from one shared `mapped`.
+    Every thread opens its own handles of the `.zarr` storages,
+    and zarr releases the GIL while it reads and decompresses the chunks,
+    so that the batches are read on several cores.
+    `.h5ad` storages are read through the shared handles,
+    their reads don't run in parallel because h5py holds a global lock.
+
+    A batch is a dictionary like from :meth:`~lamindb.core.MappedCollection.get_batch`,
+    the batches are returned in the order of the sampler.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        batch_size: The number of observations in a batch.
+        sampler: The indices of the observations, for example
+            :class:`~lamindb.core.BlockShuffleSampler`. If ``None``, all observations in order.
+        drop_last: Drop the last batch if it is smaller than ``batch_size``.
+        n_threads: The number of threads which read the batches.
+        prefetch: The number of batches which are read ahead,
+            ``2 * n_threads`` if ``None``.
+
+    Examples:
+        >>> mapped = collection.mapped(obs_keys="cell_type")
+        >>> sampler = ln.core.BlockShuffleSampler(mapped, seed=0)
+        >>> loader = ln.core.ThreadedLoader(mapped, batch_size=256, sampler=sampler)
+        >>> for epoch in range(n_epochs):
+        >>>     loader.set_epoch(epoch)
+        >>>     for batch in loader:
+        >>>         ...
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        batch_size: int = 128,
+        sampler: Iterable[int] | None = None,
+        drop_last: bool = False,
+        n_threads: int = 4,
+        prefetch: int | None = None,
+    ):
+        if batch_size < 1:
+            raise ValueError("`batch_size` should be a positive integer.")
+        prefetch = 2 * n_threads if prefetch is None else prefetch
+        if n_threads < 1 or prefetch < 1:
+            raise ValueError("`n_threads` and `prefetch` should be positive.")
+        self.mapped = mapped
+        self.batch_size = batch_size
+        self.sampler = range(mapped.n_obs) if sampler is None else sampler
+        self.drop_last = drop_last
+        self.n_threads = n_threads
+        self.prefetch = prefetch
+        self._zarr_idxs = _zarr_storage_idxs(mapped)
+        if len(self._zarr_idxs) < len(mapped.storages):
+            logger.warning(
+                "ThreadedLoader reads .h5ad files with one thread at a time,"
+                " use a DataLoader with worker processes for them."
+            )
+        self._local = threading.local()
+
+    def __len__(self):
+        n_obs = len(self.sampler)  # type: ignore
+        if self.drop_last:
+            return n_obs // self.batch_size
+        return (n_obs + self.batch_size - 1) // self.batch_size
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch of the sampler if it has one."""
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def _connect(self, storage_idx: int):
+        if storage_idx not in self._zarr_idxs:
+            return self.mapped._connect(storage_idx)
+        stores = getattr(self._local, "stores", None)
+        if stores is None:
+            stores = self._local.stores = {}
+        store = stores.get(storage_idx)
+        if store is None:
+            path = UPath(self.mapped._path_list[storage_idx])
+            store = stores[storage_idx] = registry.open("zarr", path)[1]
+        return _Connect(store)
+
+    def _read(self, idxs: np.ndarray) -> dict:
+        return self.mapped._get_batch(idxs, self._connect)
+
+    def _iter_idxs(self) -> Iterator[np.ndarray]:
+        idxs = []
+        for idx in self.sampler:
+            idxs.append(idx)
+            if len(idxs) == self.batch_size:
+                yield np.array(idxs)
+                idxs = []
+        if idxs and not self.drop_last:
+            yield np.array(idxs)
+
+    def __iter__(self) -> Iterator[dict]:
+        # the handles of the threads of the previous iteration are dropped
+        self._local = threading.local()
+        return _read_ahead(self._read, self._iter_idxs(), self.prefetch, self.n_threads)
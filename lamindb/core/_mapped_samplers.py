@@ -0,0 +1,561 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .storage._backed_access import ArrayTypes
+from .storage._read_plan import _arange_ranges
+
+if TYPE_CHECKING:
+    from ._mapped_collection import MappedCollection
+
+# used if the chunk layout of an array can't be inferred
+_DEFAULT_BLOCK_SIZE = 64
+# the number of indices drawn at once by ClassBalancedSampler
+_SAMPLE_CHUNK_SIZE = 65536
+# the number of rounds of the Feistel network of PermutationSampler
+_N_ROUNDS = 6
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _chunk_rows(lazy_data) -> int | None:
+    """Number of rows in a chunk of a dense array or a csr matrix."""
+    if isinstance(lazy_data, ArrayTypes):  # type: ignore
+        chunks = lazy_data.chunks
+        return None if chunks is None else chunks[0]
+    data_chunks = lazy_data["data"].chunks
+    n_obs = lazy_data.attrs["shape"][0]
+    n_nonzero = lazy_data["data"].shape[0]
+    if data_chunks is None or n_obs == 0 or n_nonzero == 0:
+        return None
+    # average number of rows in a chunk of data and indices
+    return max(1, round(data_chunks[0] * n_obs / n_nonzero))
+
+
+class BlockShuffleSampler:
+    """Shuffle blocks of contiguous rows of a :class:`~lamindb.core.MappedCollection`.
+
+    Fully random indices make every sample hit a different file and chunk.
+    This sampler splits each `AnnData` object into blocks of contiguous rows,
+    shuffles the order of the blocks and then shuffles the indices
+    of every `buffer_size` consecutive blocks together.
+    Larger blocks give more sequential reads, a larger buffer gives more randomness.
+
+    Pass it as ``sampler`` to `torch.utils.data.DataLoader`.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        block_size: The number of contiguous rows in a block. If ``None``,
+            uses the number of rows in a chunk of ``.X`` (or of the first of ``layers_keys``)
+            for each `AnnData` object.
+        buffer_size: The number of blocks which are shuffled together.
+        seed: The seed for shuffling. If ``None``, every iteration is shuffled differently,
+            otherwise the shuffling is determined by ``seed`` and the epoch
+            set with :meth:`~lamindb.core.BlockShuffleSampler.set_epoch`.
+
+    Examples:
+        >>> from torch.utils.data import DataLoader
+        >>> mapped = collection.mapped(obs_keys="cell_type")
+        >>> sampler = ln.core.BlockShuffleSampler(mapped, block_size=64, buffer_size=32)
+        >>> dl = DataLoader(mapped, batch_size=128, sampler=sampler)
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        block_size: int | None = None,
+        buffer_size: int = 16,
+        seed: int | None = None,
+    ):
+        if block_size is not None and block_size < 1:
+            raise ValueError("`block_size` should be a positive integer.")
+        if buffer_size < 1:
+            raise ValueError("`buffer_size` should be a positive integer.")
+        self.n_obs = mapped.n_obs
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+        if block_size is None:
+            block_sizes = self._infer_block_sizes(mapped)
+        else:
+            block_sizes = [block_size] * len(mapped.n_obs_list)
+        # blocks never cross the boundaries of the AnnData objects
+        block_starts = []
+        block_ends = []
+        offset = 0
+        for n_obs, size in zip(mapped.n_obs_list, block_sizes):
+            starts = np.arange(offset, offset + n_obs, size, dtype=np.int64)
+            block_starts.append(starts)
+            block_ends.append(np.minimum(starts + size, offset + n_obs))
+            offset += n_obs
+        self.block_starts = np.concatenate(block_starts)
+        self.block_ends = np.concatenate(block_ends)
+
+    @staticmethod
+    def _infer_block_sizes(mapped: MappedCollection) -> list[int]:
+        layers_key = mapped.layers_keys[0]
+        block_sizes = []
+        for i in range(len(mapped.storages)):
+            with mapped._connect(i) as store:
+                lazy_data = (
+                    store["X"] if layers_key == "X" else store["layers"][layers_key]
+                )
+                chunk_rows = _chunk_rows(lazy_data)
+            block_sizes.append(
+                _DEFAULT_BLOCK_SIZE if chunk_rows is None else chunk_rows
+            )
+        return block_sizes
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch to get a different shuffling for a fixed ``seed``."""
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.n_obs
+
+    def __iter__(self):
+        if self.seed is None:
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng((self.seed, self.epoch))
+        order = rng.permutation(len(self.block_starts))
+        for i in range(0, len(order), self.buffer_size):
+            buffer = order[i : i + self.buffer_size]
+            starts, ends = self.block_starts[buffer], self.block_ends[buffer]
+            idxs = _arange_ranges(starts, ends - starts)
+            rng.shuffle(idxs)
+            yield from idxs.tolist()
+
+
+class ClassBalancedSampler:
+    """Sample observations of a :class:`~lamindb.core.MappedCollection` with balanced labels.
+
+    Every combination of the labels of `obs_keys` is drawn with the same probability
+    and then an observation with these labels is drawn uniformly, with replacement.
+    This is the distribution of `torch.utils.data.WeightedRandomSampler` with
+    :meth:`~lamindb.core.MappedCollection.get_label_weights`, but the indices
+    are drawn in chunks from the groups of labels without weights for every observation.
+
+    Pass it as ``sampler`` to `torch.utils.data.DataLoader`.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        obs_keys: The label keys to balance.
+        num_samples: The number of indices in an iteration.
+            If ``None``, the number of observations in `mapped`.
+        seed: The seed for sampling. If ``None``, every iteration is different,
+            otherwise the indices are determined by ``seed`` and the epoch
+            set with :meth:`~lamindb.core.ClassBalancedSampler.set_epoch`.
+
+    Examples:
+        >>> from torch.utils.data import DataLoader
+        >>> mapped = collection.mapped(obs_keys="cell_type")
+        >>> sampler = ln.core.ClassBalancedSampler(mapped, obs_keys="cell_type")
+        >>> dl = DataLoader(mapped, batch_size=128, sampler=sampler)
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        obs_keys: str | list[str],
+        num_samples: int | None = None,
+        seed: int | None = None,
+    ):
+        self.num_samples = mapped.n_obs if num_samples is None else num_samples
+        if self.num_samples < 0:
+            raise ValueError("`num_samples` should be a non-negative integer.")
+        self.seed = seed
+        self.epoch = 0
+
+        codes, n_codes = mapped._get_label_groups(obs_keys)
+        # the observations sorted by their groups,
+        # stable sorting of 16-bit integers is a fast radix sort
+        if n_codes <= np.iinfo(np.uint16).max:
+            codes = codes.astype(np.uint16)
+        dtype = np.int32 if mapped.n_obs <= np.iinfo(np.int32).max else np.int64
+        self.order = np.argsort(codes, kind="stable").astype(dtype)
+        counts = np.bincount(codes, minlength=n_codes)
+        offsets = np.zeros(n_codes, dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+        groups = np.flatnonzero(counts)
+        self.group_counts = counts[groups]
+        self.group_offsets = offsets[groups]
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch to get different indices for a fixed ``seed``."""
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        if self.seed is None:
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng((self.seed, self.epoch))
+        for start in range(0, self.num_samples, _SAMPLE_CHUNK_SIZE):
+            size = min(_SAMPLE_CHUNK_SIZE, self.num_samples - start)
+            groups = rng.integers(len(self.group_counts), size=size)
+            positions = rng.integers(self.group_counts[groups])
+            yield from self.order[self.group_offsets[groups] + positions].tolist()
+
+
+def _mix(x: np.ndarray, key: np.uint64) -> np.ndarray:
+    """Round function of the Feistel network, the finalizer of splitmix64."""
+    z = (x ^ key) * _MIX_1
+    z ^= z >> np.uint64(31)
+    z *= _MIX_2
+    z ^= z >> np.uint64(29)
+    return z
+
+
+class _FeistelPermutation:
+    """Seeded bijection of `[0, n)` which is computed for every element separately.
+
+    A Feistel network permutes `[0, 4**half_bits)` with `4**half_bits >= n`,
+    values outside of `[0, n)` are permuted again until they are inside (cycle walking).
+    """
+
+    def __init__(self, n: int, seed: tuple):
+        self.n = n
+        half_bits = max(1, ((n - 1).bit_length() + 1) // 2)
+        self._shift = np.uint64(half_bits)
+        self._mask = np.uint64((1 << half_bits) - 1)
+        self._keys = np.random.default_rng(seed).integers(
+            0, 2**64 - 1, size=_N_ROUNDS, dtype=np.uint64, endpoint=True
+        )
+
+    def _encrypt(self, x: np.ndarray) -> np.ndarray:
+        left, right = x >> self._shift, x & self._mask
+        for key in self._keys:
+            left, right = right, left ^ (_mix(right, key) & self._mask)
+        return (left << self._shift) | right
+
+    def _decrypt(self, x: np.ndarray) -> np.ndarray:
+        left, right = x >> self._shift, x & self._mask
+        for key in self._keys[::-1]:
+            left, right = right ^ (_mix(left, key) & self._mask), left
+        return (left << self._shift) | right
+
+    def _walk(self, x, func) -> np.ndarray:
+        result = func(np.asarray(x, dtype=np.uint64))
+        outside = np.flatnonzero(result >= np.uint64(self.n))
+        while len(outside) > 0:
+            result[outside] = func(result[outside])
+            outside = outside[result[outside] >= np.uint64(self.n)]
+        return result.astype(np.int64)
+
+    def __call__(self, x) -> np.ndarray:
+        return self._walk(x, self._encrypt)
+
+    def inverse(self, x) -> np.ndarray:
+        return self._walk(x, self._decrypt)
+
+
+class PermutationSampler:
+    """Shuffle a :class:`~lamindb.core.MappedCollection` without storing a permutation.
+
+    `torch.randperm(n_obs)` and `np.random.permutation(n_obs)` allocate 8 bytes
+    for every observation in every epoch and every worker.
+    This sampler computes the index at every position of the epoch with a seeded
+    Feistel network, a bijection of ``[0, n_obs)``, so that its memory doesn't grow
+    with the number of observations and an epoch can be resumed from any position
+    without regenerating the indices before it.
+
+    With ``block_size``, the blocks of contiguous rows of every `AnnData` object
+    are permuted instead of the observations and the indices of every `buffer_size`
+    consecutive blocks are shuffled together, as in
+    :class:`~lamindb.core.BlockShuffleSampler`.
+    The memory then grows only with the number of `AnnData` objects.
+
+    Pass it as ``sampler`` to `torch.utils.data.DataLoader`.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        block_size: The number of contiguous rows in a block. If ``None``,
+            the observations are permuted one by one.
+        buffer_size: The number of blocks which are shuffled together.
+        seed: The seed for shuffling, the shuffling is determined by ``seed``
+            and the epoch set with :meth:`~lamindb.core.PermutationSampler.set_epoch`.
+
+    Examples:
+        >>> from torch.utils.data import DataLoader
+        >>> mapped = collection.mapped(obs_keys="cell_type")
+        >>> sampler = ln.core.PermutationSampler(mapped, block_size=64, seed=0)
+        >>> dl = DataLoader(mapped, batch_size=128, sampler=sampler)
+        >>> # resume after 1000 batches of the epoch
+        >>> sampler.set_epoch(epoch, start=1000 * 128)
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        block_size: int | None = None,
+        buffer_size: int = 16,
+        seed: int = 0,
+    ):
+        if block_size is not None and block_size < 1:
+            raise ValueError("`block_size` should be a positive integer.")
+        if buffer_size < 1:
+            raise ValueError("`buffer_size` should be a positive integer.")
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+        n_obs_list = np.array(mapped.n_obs_list, dtype=np.int64)
+        self.n_obs = int(n_obs_list.sum())
+        if block_size is None:
+            return
+        # the first index and the first block of every file
+        self.file_starts = np.zeros(len(n_obs_list) + 1, dtype=np.int64)
+        np.cumsum(n_obs_list, out=self.file_starts[1:])
+        self.block_offsets = np.zeros(len(n_obs_list) + 1, dtype=np.int64)
+        np.cumsum(-(-n_obs_list // block_size), out=self.block_offsets[1:])
+        # the last blocks of the files are shorter if the block size doesn't divide them
+        remainders = n_obs_list % block_size
+        has_short = remainders > 0
+        self._short_blocks = self.block_offsets[1:][has_short] - 1
+        self._shortfalls = block_size - remainders[has_short]
+
+    def set_epoch(self, epoch: int, start: int = 0):
+        """Set the epoch and the position in the epoch to start from.
+
+        Resuming from ``start`` doesn't compute the indices before it.
+        """
+        if not 0 <= start <= self.n_obs:
+            raise ValueError("`start` should be in [0, n_obs].")
+        self.epoch = epoch
+        self.start = start
+
+    def __len__(self):
+        return self.n_obs - self.start
+
+    def __iter__(self):
+        if self.block_size is None:
+            permutation = _FeistelPermutation(self.n_obs, (self.seed, self.epoch))
+            for start in range(self.start, self.n_obs, _SAMPLE_CHUNK_SIZE):
+                end = min(start + _SAMPLE_CHUNK_SIZE, self.n_obs)
+                yield from permutation(np.arange(start, end)).tolist()
+        else:
+            yield from self._iter_blocks()
+
+    def _iter_blocks(self):
+        n_blocks = int(self.block_offsets[-1])
+        permutation = _FeistelPermutation(n_blocks, (self.seed, self.epoch))
+        # the positions of the short blocks in this epoch
+        positions = permutation.inverse(self._short_blocks)
+        order = np.argsort(positions)
+        short_positions = positions[order]
+        cum_shortfalls = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(self._shortfalls[order], out=cum_shortfalls[1:])
+
+        def block_start(j: int) -> int:
+            # the position in the epoch of the first index of the j-th block
+            n_short = np.searchsorted(short_positions, j)
+            return j * self.block_size - int(cum_shortfalls[n_short])
+
+        # the buffer with the start position, found by bisection
+        lo, hi = 0, n_blocks
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if block_start(mid) <= self.start:
+                lo = mid
+            else:
+                hi = mid
+        first_buffer = lo // self.buffer_size
+        skip = self.start - block_start(first_buffer * self.buffer_size)
+
+        n_buffers = -(-n_blocks // self.buffer_size)
+        step = max(1, _SAMPLE_CHUNK_SIZE // (self.block_size * self.buffer_size))
+        for buffer in range(first_buffer, n_buffers, step):
+            j_end = min((buffer + step) * self.buffer_size, n_blocks)
+            blocks = permutation(np.arange(buffer * self.buffer_size, j_end))
+            files = np.searchsorted(self.block_offsets, blocks, side="right") - 1
+            starts = (
+                self.file_starts[files]
+                + (blocks - self.block_offsets[files]) * self.block_size
+            )
+            lengths = np.minimum(starts + self.block_size, self.file_starts[files + 1])
+            lengths -= starts
+            idxs = _arange_ranges(starts, lengths)
+            bounds = np.zeros(len(blocks) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=bounds[1:])
+            bounds = bounds[:: self.buffer_size].tolist() + [len(idxs)]
+            for i in range(len(bounds) - 1):
+                rng = np.random.default_rng((self.seed, self.epoch, buffer + i))
+                rng.shuffle(idxs[bounds[i] : bounds[i + 1]])
+            yield from idxs[skip:].tolist()
+            skip = 0
+
+
+def _get_worker_info():
+    try:
+        from torch.utils.data import get_worker_info
+    except ImportError:
+        return None
+    return get_worker_info()
+
+
+def _get_rank(rank: int | None, world_size: int | None) -> tuple[int, int]:
+    """Get the rank and the world size from `torch.distributed` if not passed."""
+    if rank is None or world_size is None:
+        try:
+            import torch.distributed as dist
+
+            initialized = dist.is_available() and dist.is_initialized()
+        except ImportError:
+            initialized = False
+        if rank is None:
+            rank = dist.get_rank() if initialized else 0
+        if world_size is None:
+            world_size = dist.get_world_size() if initialized else 1
+    if world_size < 1 or not 0 <= rank < world_size:
+        raise ValueError("`rank` should be in [0, world_size).")
+    return rank, world_size
+
+
+class ShardSampler:
+    """Shard a :class:`~lamindb.core.MappedCollection` for distributed training.
+
+    `torch.utils.data.DistributedSampler` gives every rank indices from all files.
+    This sampler orders the `AnnData` objects and assigns contiguous ranges of rows
+    to the ranks, so that every rank reads only a fraction of the files and reads them
+    mostly sequentially. The ranges have the same number of rows for all ranks.
+    The order of the files is shuffled deterministically for every epoch,
+    so the assignments of the files to the ranks change between epochs.
+
+    Inside each rank, the rows of every file are shuffled as in
+    :class:`~lamindb.core.BlockShuffleSampler`. If the sampler is iterated
+    inside a worker of `torch.utils.data.DataLoader`, for example from
+    an iterable dataset, the range of the rank is split further between the workers.
+
+    Pass it as ``sampler`` to `torch.utils.data.DataLoader`.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        rank: The rank of this process. If ``None``, taken from `torch.distributed`
+            if it is initialized, otherwise ``0``.
+        world_size: The number of ranks. If ``None``, taken from `torch.distributed`
+            if it is initialized, otherwise ``1``.
+        shuffle: Shuffle the files and the rows.
+        block_size: The number of contiguous rows in a block for shuffling the rows.
+        buffer_size: The number of blocks which are shuffled together.
+        seed: The seed for shuffling, the same on all ranks.
+        drop_last: Drop the last rows to give all ranks the same number of rows,
+            otherwise rows from the start are repeated.
+
+    Examples:
+        >>> from torch.utils.data import DataLoader
+        >>> mapped = collection.mapped(obs_keys="cell_type")
+        >>> sampler = ln.core.ShardSampler(mapped, seed=0)
+        >>> dl = DataLoader(mapped, batch_size=128, sampler=sampler)
+        >>> for epoch in range(n_epochs):
+        >>>     sampler.set_epoch(epoch)
+        >>>     for batch in dl:
+        >>>         ...
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        rank: int | None = None,
+        world_size: int | None = None,
+        shuffle: bool = True,
+        block_size: int = _DEFAULT_BLOCK_SIZE,
+        buffer_size: int = 16,
+        seed: int = 0,
+        drop_last: bool = False,
+    ):
+        rank, world_size = _get_rank(rank, world_size)
+        if block_size < 1 or buffer_size < 1:
+            raise ValueError("`block_size` and `buffer_size` should be positive.")
+        self.rank = rank
+        self.world_size = world_size
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+        self.n_obs_list = np.array(mapped.n_obs_list, dtype=np.int64)
+        self.n_obs = int(self.n_obs_list.sum())
+        if drop_last:
+            self.num_samples = self.n_obs // world_size
+        else:
+            self.num_samples = -(-self.n_obs // world_size)
+        # the first index of every file
+        self.file_starts = np.zeros(len(self.n_obs_list), dtype=np.int64)
+        np.cumsum(self.n_obs_list[:-1], out=self.file_starts[1:])
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch to get a different assignment and shuffling."""
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def get_ranges(self, rng: np.random.Generator | None = None):
+        """Get the index ranges of this rank for the current epoch.
+
+        Returns the starts and the ends of the ranges, each range is within one file.
+        """
+        if rng is None:
+            rng = np.random.default_rng((self.seed, self.epoch))
+        n_files = len(self.n_obs_list)
+        order = rng.permutation(n_files) if self.shuffle else np.arange(n_files)
+        # the files in this order are virtually concatenated
+        # and the concatenation is repeated to pad the ranges of the last ranks
+        bounds = np.zeros(n_files + 1, dtype=np.int64)
+        np.cumsum(self.n_obs_list[order], out=bounds[1:])
+        start = self.rank * self.num_samples
+        end = start + self.num_samples
+        starts, ends = [], []
+        while start < end and self.n_obs > 0:
+            pos = start % self.n_obs
+            i = np.searchsorted(bounds, pos, side="right") - 1
+            length = min(bounds[i + 1] - pos, end - start)
+            file_start = self.file_starts[order[i]] + pos - bounds[i]
+            starts.append(file_start)
+            ends.append(file_start + length)
+            start += length
+        return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        starts, ends = self.get_ranges(rng)
+        worker_info = _get_worker_info()
+        if worker_info is not None and worker_info.num_workers > 1:
+            starts, ends = _split_ranges(
+                starts, ends, worker_info.id, worker_info.num_workers
+            )
+        for start, end in zip(starts, ends):
+            if not self.shuffle:
+                yield from range(start, end)
+                continue
+            block_starts = np.arange(start, end, self.block_size, dtype=np.int64)
+            block_ends = np.minimum(block_starts + self.block_size, end)
+            order = rng.permutation(len(block_starts))
+            for i in range(0, len(order), self.buffer_size):
+                buffer = order[i : i + self.buffer_size]
+                b_starts, b_ends = block_starts[buffer], block_ends[buffer]
+                idxs = _arange_ranges(b_starts, b_ends - b_starts)
+                rng.shuffle(idxs)
+                yield from idxs.tolist()
+
+
+def _split_ranges(starts: np.ndarray, ends: np.ndarray, part: int, n_parts: int):
+    """Get the `part`-th of `n_parts` contiguous parts of the concatenated ranges."""
+    bounds = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=bounds[1:])
+    total = bounds[-1]
+    part_start, part_end = total * part // n_parts, total * (part + 1) // n_parts
+    # clip every range to the part
+    lo = np.clip(part_start - bounds[:-1], 0, None)
+    hi = np.clip(part_end - bounds[:-1], None, ends - starts)
+    keep = hi > lo
+    return (starts + lo)[keep], (starts + hi)[keep]
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import os
+import stat
+import threading
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+from lamin_utils import logger
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from ._mapped_collection import MappedCollection
+
+# the methods of the served mapped collection which clients can call
+_METHODS = {
+    "get_batch",
+    "get_label_weights",
+    "get_merged_labels",
+    "get_merged_categories",
+    "chunk_cache_info",
+    "_get_label_groups",
+}
+# the attributes which are sent to clients once on connection
+_ATTRIBUTES = (
+    "n_obs",
+    "n_obs_list",
+    "n_vars",
+    "var_joint",
+    "layers_keys",
+    "obs_keys",
+    "obsm_keys",
+    "encoders",
+    "sparse",
+    "original_shapes",
+)
+
+
+def _remove_socket(address: str):
+    """Remove a socket file left over by a server which wasn't closed."""
+    path = Path(address)
+    try:
+        mode = path.stat().st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{address} exists and is not a socket.")
+    path.unlink()
+
+
+def _key_path(address: str) -> Path:
+    """The file with the generated key of the server at `address`."""
+    return Path(f"{address}.key")
+
+
+def _write_key(address: str, authkey: bytes):
+    """Write the key to a file which only the owner can read."""
+    path = _key_path(address)
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+
+
+class MappedServer:
+    """Serve batches of a :class:`~lamindb.core.MappedCollection` to local processes.
+
+    Several training processes on one machine, for example one per GPU,
+    would each open the same files and decode the same chunks.
+    Instead, the server owns one mapped collection and serves batches
+    by lists of indices through a Unix socket, every client connection
+    is handled in its own thread.
+    The clients are lightweight :class:`~lamindb.core.MappedClient` datasets.
+    The clients authenticate with a key, as the requests are unpickled by the server.
+    Only the user who started the server can connect to the socket and read the
+    generated key.
+    Create `mapped` with ``chunk_cache_size`` to share the decompressed chunks
+    between all clients.
+
+    Run the server in a separate process with
+    :meth:`~lamindb.core.MappedServer.serve_forever`
+    or in the background of a process with :meth:`~lamindb.core.MappedServer.start`.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        address: The path of the Unix socket.
+        authkey: The key which clients need to connect. If ``None``, a random key
+            is generated and written to the file ``f"{address}.key"``,
+            which :class:`~lamindb.core.MappedClient` reads.
+
+    Examples:
+        >>> # in the server process
+        >>> mapped = ln.core.MappedCollection(paths, obs_keys="cell_type", chunk_cache_size=2**32)
+        >>> ln.core.MappedServer(mapped, "/tmp/mapped.sock").serve_forever()
+        >>> # in every training process
+        >>> from torch.utils.data import DataLoader
+        >>> dataset = ln.core.MappedClient("/tmp/mapped.sock")
+        >>> dl = DataLoader(dataset, batch_size=128, shuffle=True)
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        address: str | Path,
+        authkey: bytes | None = None,
+    ):
+        self.mapped = mapped
+        self.address = str(address)
+        self._key_file = authkey is None
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self._listener: Listener | None = None
+        self._thread: threading.Thread | None = None
+        self._closed = threading.Event()
+
+    def _listen(self):
+        if self._listener is not None:
+            raise RuntimeError("The server is already running.")
+        _remove_socket(self.address)
+        # create the socket accessible only by the owner,
+        # a chmod after bind would leave it open to other users for a moment
+        umask = os.umask(0o177)
+        try:
+            self._listener = Listener(
+                self.address, family="AF_UNIX", authkey=self.authkey
+            )
+        finally:
+            os.umask(umask)
+        if self._key_file:
+            _write_key(self.address, self.authkey)
+        self._closed.clear()
+
+    def start(self):
+        """Serve in a background thread of this process."""
+        self._listen()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in this thread until :meth:`~lamindb.core.MappedServer.close` is called."""
+        self._listen()
+        try:
+            self._accept()
+        finally:
+            self.close()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()  # type: ignore
+            except Exception as e:
+                if self._closed.is_set():
+                    return
+                logger.warning(f"MappedServer failed to accept a client: {e}")
+                continue
+            if self._closed.is_set():
+                conn.close()
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while not self._closed.is_set():
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    result = self._call(method, args)
+                except Exception as e:
+                    conn.send((False, e))
+                else:
+                    conn.send((True, result))
+
+    def _call(self, method: str, args: tuple):
+        if method == "attributes":
+            return {key: getattr(self.mapped, key) for key in _ATTRIBUTES}
+        if method not in _METHODS:
+            raise ValueError(f"MappedServer doesn't serve {method}.")
+        return getattr(self.mapped, method)(*args)
+
+    def close(self):
+        """Stop accepting clients and remove the socket and the key file.
+
+        Doesn't close `mapped`.
+        """
+        if self._listener is None:
+            return
+        self._closed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # wake up the thread which is blocked in accept
+            try:
+                Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+            except Exception:
+                pass
+            self._thread.join()
+        self._listener.close()
+        if self._key_file:
+            _key_path(self.address).unlink(missing_ok=True)
+        self._listener = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MappedClient:
+    """Map-style dataset which gets batches from a :class:`~lamindb.core.MappedServer`.
+
+    Has the same attributes as the served :class:`~lamindb.core.MappedCollection`
+    for sizes, variables and labels, and returns the same samples and batches.
+    Can be used with the samplers, :class:`~lamindb.core.BlockShuffleSampler`
+    needs an explicit ``block_size``.
+    Every process connects on its first request,
+    so the client can be passed to `torch.utils.data.DataLoader` with workers.
+
+    Args:
+        address: The path of the Unix socket of the server.
+        authkey: The key of the server. If ``None``, read from the file
+            ``f"{address}.key"`` written by the server.
+    """
+
+    def __init__(self, address: str | Path, authkey: bytes | None = None):
+        self.address = str(address)
+        if authkey is None:
+            authkey = _key_path(self.address).read_bytes()
+        self.authkey = authkey
+        self._init_conn()
+        attributes = self._request("attributes")
+        self.n_obs: int = attributes["n_obs"]
+        self.n_obs_list: list[int] = attributes["n_obs_list"]
+        self.n_vars: int | None = attributes["n_vars"]
+        self.var_joint: pd.Index | None = attributes["var_joint"]
+        self.layers_keys: list[str] = attributes["layers_keys"]
+        self.obs_keys: list[str] | None = attributes["obs_keys"]
+        self.obsm_keys: list[str] | None = attributes["obsm_keys"]
+        self.encoders: dict = attributes["encoders"]
+        self.sparse: bool = attributes["sparse"]
+        self.original_shapes: list[tuple] = attributes["original_shapes"]
+        self._obs_offsets = np.zeros(len(self.n_obs_list) + 1, dtype=np.int64)
+        np.cumsum(self.n_obs_list, out=self._obs_offsets[1:])
+
+    def _init_conn(self):
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_conn"], state["_lock"], state["_pid"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_conn()
+
+    def _request(self, method: str, *args):
+        if self._pid != os.getpid():
+            # can't share the connection of the parent process after fork
+            self._init_conn()
+        with self._lock:
+            if self._conn is None:
+                self._conn = Client(
+                    self.address, family="AF_UNIX", authkey=self.authkey
+                )
+            self._conn.send((method, args))
+            success, result = self._conn.recv()
+        if not success:
+            raise result
+        return result
+
+    def __len__(self):
+        return self.n_obs
+
+    @property
+    def shape(self):
+        """Shape of the (virtually aligned) dataset."""
+        return (self.n_obs, self.n_vars)
+
+    def __getitem__(self, idx: int | list[int] | np.ndarray):
+        if isinstance(idx, (list, np.ndarray)):
+            return self.get_batch(idx)
+        return self.__getitems__([idx])[0]
+
+    def __getitems__(self, idxs: list[int]) -> list[dict]:
+        """Get the samples for a list of indices with one request."""
+        batch = self.get_batch(idxs)
+        return [
+            {key: value[i] for key, value in batch.items()} for i in range(len(idxs))
+        ]
+
+    def get_batch(self, idxs: list[int] | np.ndarray) -> dict:
+        """Get a batch of samples for a list of indices from the server."""
+        return self._request("get_batch", np.asarray(idxs, dtype=np.int64))
+
+    def get_label_weights(self, obs_keys: str | list[str]):
+        """Get all weights for the given label keys."""
+        return self._request("get_label_weights", obs_keys)
+
+    def _get_label_groups(self, obs_keys: str | list[str]):
+        return self._request("_get_label_groups", obs_keys)
+
+    def get_merged_labels(self, label_key: str):
+        """Get merged labels for `label_key` from all `.obs`."""
+        return self._request("get_merged_labels", label_key)
+
+    def get_merged_categories(self, label_key: str):
+        """Get merged categories for `label_key` from all `.obs`."""
+        return self._request("get_merged_categories", label_key)
+
+    def chunk_cache_info(self) -> dict | None:
+        """Statistics of the chunk cache of the server."""
+        return self._request("chunk_cache_info")
+
+    def close(self):
+        """Close the connection of this process to the server."""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import queue
+import threading
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from ._mapped_samplers import ShardSampler, _get_worker_info, _split_ranges
+
+if TYPE_CHECKING:
+    from ._mapped_collection import MappedCollection
+
+try:
+    from torch.utils.data import IterableDataset as _IterableDataset
+except ImportError:
+    _IterableDataset = object  # type: ignore
+
+
+class _Error:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_DONE = object()
+
+
+def _prefetch(iterator: Iterator, size: int) -> Iterator:
+    """Iterate in a background thread, keep up to `size` items ahead."""
+    items: queue.Queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Error(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Error):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _concat_batches(batches: list[dict]) -> dict:
+    result = {}
+    for key, value in batches[0].items():
+        values = [batch[key] for batch in batches]
+        if isinstance(value, csr_matrix):
+            result[key] = vstack(values, format="csr")
+        else:
+            result[key] = np.concatenate(values)
+    return result
+
+
+def _take(batch: dict, idxs: np.ndarray) -> dict:
+    return {key: value[idxs] for key, value in batch.items()}
+
+
+class MappedStream(_IterableDataset):
+    """Stream a :class:`~lamindb.core.MappedCollection` sequentially in batches.
+
+    Random access to single observations is slow for files in the cloud,
+    for example with ``collection.mapped(stream=True)``.
+    This iterable dataset reads the `AnnData` objects from start to end
+    in chunks of ``chunk_size`` contiguous rows with coalesced range requests,
+    mixes the chunks of ``n_files_mixed`` files in a shuffle buffer
+    and returns shuffled batches. The chunks are read in a background thread
+    ahead of the training loop, including the chunks of the next files.
+
+    The rows are distributed between the ranks of distributed training
+    as by :class:`~lamindb.core.ShardSampler`, every rank gets contiguous ranges
+    of the same number of rows and returns the same number of batches,
+    differently in every epoch. The ranges of a rank are split further
+    between the workers of `torch.utils.data.DataLoader`.
+
+    A batch is a dictionary like from :meth:`~lamindb.core.MappedCollection.get_batch`.
+    Pass ``batch_size=None`` to `torch.utils.data.DataLoader`.
+    For more than one worker, create `mapped` with ``parallel=True``.
+
+    Args:
+        mapped: A mapped collection, for example from :meth:`~lamindb.Collection.mapped`.
+        batch_size: The number of observations in a batch,
+            the last batch of a worker can be smaller.
+        chunk_size: The number of contiguous rows read with one request.
+        shuffle_size: The number of observations in the shuffle buffer.
+        n_files_mixed: The number of ranges which are read together to mix their chunks,
+            every range is within one file.
+        shuffle: Shuffle the files and the observations.
+        seed: The seed for shuffling, the same on all ranks.
+        prefetch: The number of chunks read ahead in the background.
+        rank: The rank of this process. If ``None``, taken from `torch.distributed`
+            if it is initialized, otherwise ``0``.
+        world_size: The number of ranks. If ``None``, taken from `torch.distributed`
+            if it is initialized, otherwise ``1``.
+        drop_last: Drop the last rows to give all ranks the same number of rows,
+            otherwise rows from the start are repeated.
+
+    Examples:
+        >>> from torch.utils.data import DataLoader
+        >>> mapped = collection.mapped(obs_keys="cell_type", stream=True, parallel=True)
+        >>> stream = ln.core.MappedStream(mapped, batch_size=256)
+        >>> dl = DataLoader(stream, batch_size=None, num_workers=4)
+        >>> for epoch in range(n_epochs):
+        >>>     stream.set_epoch(epoch)
+        >>>     for batch in dl:
+        >>>         ...
+    """
+
+    def __init__(
+        self,
+        mapped: MappedCollection,
+        batch_size: int = 128,
+        chunk_size: int = 1024,
+        shuffle_size: int = 16384,
+        n_files_mixed: int = 4,
+        shuffle: bool = True,
+        seed: int = 0,
+        prefetch: int = 4,
+        rank: int | None = None,
+        world_size: int | None = None,
+        drop_last: bool = False,
+    ):
+        if min(batch_size, chunk_size, shuffle_size, n_files_mixed, prefetch) < 1:
+            raise ValueError(
+                "`batch_size`, `chunk_size`, `shuffle_size`, `n_files_mixed` "
+                "and `prefetch` should be positive."
+            )
+        self.mapped = mapped
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.shuffle_size = shuffle_size
+        self.n_files_mixed = n_files_mixed
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        self._shards = ShardSampler(
+            mapped, rank, world_size, shuffle=shuffle, seed=seed, drop_last=drop_last
+        )
+        self.rank, self.world_size = self._shards.rank, self._shards.world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch to get a different assignment and shuffling."""
+        self.epoch = epoch
+
+    def get_ranges(
+        self, worker_id: int = 0, num_workers: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get the index ranges of a worker of this rank for the current epoch.
+
+        Returns the starts and the ends of the ranges, each range is within one file.
+        """
+        self._shards.set_epoch(self.epoch)
+        starts, ends = self._shards.get_ranges()
+        if num_workers > 1:
+            starts, ends = _split_ranges(starts, ends, worker_id, num_workers)
+        return starts, ends
+
+    def _read_chunks(self, starts: np.ndarray, ends: np.ndarray) -> Iterator[dict]:
+        """Read the ranges in groups, alternating between the chunks of a group."""
+        for i in range(0, len(starts), self.n_files_mixed):
+            group = list(
+                zip(
+                    starts[i : i + self.n_files_mixed].tolist(),
+                    ends[i : i + self.n_files_mixed].tolist(),
+                )
+            )
+            while group:
+                next_group = []
+                for start, end in group:
+                    chunk_end = min(start + self.chunk_size, end)
+                    yield self.mapped.get_batch(np.arange(start, chunk_end))
+                    if chunk_end < end:
+                        next_group.append((chunk_end, end))
+                group = next_group
+
+    def _iter_batches(self, buffer: dict, idxs: np.ndarray):
+        for start in range(0, len(idxs), self.batch_size):
+            yield _take(buffer, idxs[start : start + self.batch_size])
+
+    def __iter__(self):
+        worker_info = _get_worker_info()
+        worker_id, num_workers = 0, 1
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        starts, ends = self.get_ranges(worker_id, num_workers)
+        part = self.rank * num_workers + worker_id
+        rng = np.random.default_rng((self.seed, self.epoch, part))
+
+        chunks, n_rows = [], 0
+        for chunk in _prefetch(self._read_chunks(starts, ends), self.prefetch):
+            chunks.append(chunk)
+            n_rows += len(chunk["_store_idx"])
+            if n_rows < self.shuffle_size:
+                continue
+            # return full batches from the buffer, keep half of it for mixing
+            n_keep = n_rows // 2 if self.shuffle else 0
+            n_return = (n_rows - n_keep) // self.batch_size * self.batch_size
+            if n_return == 0:
+                continue
+            buffer = _concat_batches(chunks)
+            idxs = rng.permutation(n_rows) if self.shuffle else np.arange(n_rows)
+            yield from self._iter_batches(buffer, idxs[:n_return])
+            chunks, n_rows = [_take(buffer, idxs[n_return:])], n_rows - n_return
+        if n_rows > 0:
+            buffer = _concat_batches(chunks)
+            idxs = rng.permutation(n_rows) if self.shuffle else np.arange(n_rows)
+            yield from self._iter_batches(buffer, idxs)
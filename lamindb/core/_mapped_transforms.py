@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def _float_dtype(dtype: np.dtype) -> np.dtype:
+    return dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.float32)
+
+
+def _row_scale(X: np.ndarray | csr_matrix, scale: np.ndarray, copy: bool = True):
+    """Multiply every row of `X` by `scale`, in place for floats if `copy=False`."""
+    if isinstance(X, csr_matrix):
+        data = X.data.astype(_float_dtype(X.dtype), copy=copy)
+        data *= np.repeat(scale, np.diff(X.indptr)).astype(data.dtype, copy=False)
+        return csr_matrix((data, X.indices, X.indptr), shape=X.shape)
+    X = X.astype(_float_dtype(X.dtype), copy=copy)
+    X *= scale.astype(X.dtype, copy=False).reshape(-1, *([1] * (X.ndim - 1)))
+    return X
+
+
+def _apply_transforms(
+    X: np.ndarray | csr_matrix, transforms: list, dense: bool
+) -> np.ndarray | csr_matrix:
+    """Apply the transforms to a batch.
+
+    A csr matrix is densified before the first transform which doesn't keep zeros,
+    and at the end if `dense` is `True`.
+    """
+    # the batch is new, it can be scaled in place until a transform
+    # which isn't built-in returns an array which might be used elsewhere
+    owned = True
+    for transform in transforms:
+        if isinstance(X, csr_matrix) and not getattr(transform, "keeps_zeros", False):
+            X = X.toarray()
+        if isinstance(transform, NormalizeTotal):
+            X = transform._normalize(X, copy=not owned)
+            owned = True
+        else:
+            X = transform(X)
+            # AsType returns the same array for the same dtype
+            if not isinstance(transform, AsType):
+                owned = isinstance(transform, (Log1p, Clip, Standardize))
+    if dense and isinstance(X, csr_matrix):
+        X = X.toarray()
+    return X
+
+
+class NormalizeTotal:
+    """Scale every observation to the same sum of values.
+
+    A batch transform for :class:`~lamindb.core.MappedCollection`,
+    the sums are computed over the returned variables.
+
+    Args:
+        target_sum: The sum of values of every observation after scaling.
+    """
+
+    keeps_zeros = True
+
+    def __init__(self, target_sum: float = 1e4):
+        self.target_sum = target_sum
+
+    def __call__(self, X: np.ndarray | csr_matrix) -> np.ndarray | csr_matrix:
+        return self._normalize(X, copy=True)
+
+    def _normalize(
+        self, X: np.ndarray | csr_matrix, copy: bool
+    ) -> np.ndarray | csr_matrix:
+        if X.ndim == 1:
+            return self._normalize(X.reshape(1, -1), copy)[0]
+        sums = np.asarray(X.sum(axis=1), dtype=np.float64).ravel()
+        scale = np.zeros_like(sums)
+        np.divide(self.target_sum, sums, out=scale, where=sums != 0)
+        return _row_scale(X, scale, copy)
+
+
+class Log1p:
+    """Apply `log(1 + x)`.
+
+    A batch transform for :class:`~lamindb.core.MappedCollection`.
+    """
+
+    keeps_zeros = True
+
+    def __call__(self, X: np.ndarray | csr_matrix) -> np.ndarray | csr_matrix:
+        if isinstance(X, csr_matrix):
+            data = np.log1p(X.data, dtype=_float_dtype(X.dtype))
+            return csr_matrix((data, X.indices, X.indptr), shape=X.shape)
+        return np.log1p(X, dtype=_float_dtype(X.dtype))
+
+
+class Clip:
+    """Clip values to an interval.
+
+    A batch transform for :class:`~lamindb.core.MappedCollection`.
+
+    Args:
+        min_value: The minimum value, no lower bound if ``None``.
+        max_value: The maximum value, no upper bound if ``None``.
+    """
+
+    def __init__(self, min_value: float | None = None, max_value: float | None = None):
+        if min_value is None and max_value is None:
+            raise ValueError("Pass at least one of `min_value` and `max_value`.")
+        self.min_value = min_value
+        self.max_value = max_value
+        self.keeps_zeros = (min_value is None or min_value <= 0) and (
+            max_value is None or max_value >= 0
+        )
+
+    def __call__(self, X: np.ndarray | csr_matrix) -> np.ndarray | csr_matrix:
+        if isinstance(X, csr_matrix):
+            data = np.clip(X.data, self.min_value, self.max_value)
+            return csr_matrix((data, X.indices, X.indptr), shape=X.shape)
+        return np.clip(X, self.min_value, self.max_value)
+
+
+class AsType:
+    """Convert values to a dtype.
+
+    A batch transform for :class:`~lamindb.core.MappedCollection`.
+
+    Args:
+        dtype: The dtype, for example ``"float32"``.
+    """
+
+    keeps_zeros = True
+
+    def __init__(self, dtype: str | np.dtype):
+        self.dtype = np.dtype(dtype)
+
+    def __call__(self, X: np.ndarray | csr_matrix) -> np.ndarray | csr_matrix:
+        return X.astype(self.dtype, copy=False)
+
+
+class Standardize:
+    """Subtract precomputed means and divide by standard deviations per variable.
+
+    A batch transform for :class:`~lamindb.core.MappedCollection`.
+    Without ``mean``, only scales and keeps sparse batches sparse.
+
+    Args:
+        mean: The means of the returned variables.
+        std: The standard deviations of the returned variables,
+            zeros are replaced by ones.
+    """
+
+    def __init__(self, mean: np.ndarray | None = None, std: np.ndarray | None = None):
+        self.mean = None if mean is None else np.asarray(mean)
+        if std is not None:
+            std = np.asarray(std, dtype=np.float64)
+            std = np.where(std == 0, 1.0, std)
+        self.std = std
+        self.keeps_zeros = mean is None
+
+    def _check(self, n_vars: int):
+        for name in ("mean", "std"):
+            stats = getattr(self, name)
+            if stats is not None and len(stats) != n_vars:
+                raise ValueError(
+                    f"`{name}` has {len(stats)} values, but there are {n_vars} variables."
+                )
+
+    def __call__(self, X: np.ndarray | csr_matrix) -> np.ndarray | csr_matrix:
+        self._check(X.shape[-1])
+        if isinstance(X, csr_matrix):
+            data = X.data.astype(_float_dtype(X.dtype))
+            if self.std is not None:
+                data /= self.std[X.indices].astype(data.dtype, copy=False)
+            return csr_matrix((data, X.indices, X.indptr), shape=X.shape)
+        X = X.astype(_float_dtype(X.dtype))
+        if self.mean is not None:
+            X -= self.mean.astype(X.dtype, copy=False)
+        if self.std is not None:
+            X /= self.std.astype(X.dtype, copy=False)
+        return X
@@ -9,6 +9,7 @@ from lamindb_setup._set_managed_storage import set_managed_storage
 from lamindb_setup.core._settings import settings as setup_settings
 from lamindb_setup.core._settings_instance import sanitize_git_repo_url
 
+from ._backed_settings import BackedSettings, backed
 from ._transform_settings import TransformSettings, transform
 
 if TYPE_CHECKING:
@@ -104,6 +105,11 @@ class Settings:
         """Transform settings."""
         return transform
 
+    @property
+    def backed(self) -> BackedSettings:
+        """Settings for cloud-backed access."""
+        return backed
+
     @property
     def sync_git_repo(self) -> str | None:
         """Sync transforms with scripts in git repository.
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from functools import cached_property
+from functools import cached_property, partial
 from itertools import chain
 from typing import TYPE_CHECKING, Callable, Mapping, Union
 
@@ -11,7 +12,7 @@ import numpy as np
 import pandas as pd
 from anndata import AnnData
 from anndata import __version__ as anndata_version
-from anndata._core.index import Index, _normalize_indices
+from anndata._core.index import Index, _normalize_indices, unpack_index
 from anndata._core.views import _resolve_idx
 from anndata._io.h5ad import read_dataframe_legacy as read_dataframe_legacy_h5
 from anndata._io.specs.registry import get_spec, read_elem, read_elem_partial
@@ -21,9 +22,17 @@ from lamin_utils import logger
 from lamindb_setup.core.upath import UPath, create_mapper, infer_filesystem
 from lnschema_core import Artifact
 from packaging import version
+from scipy.sparse import csr_matrix
 
+from lamindb.core._settings import settings
 from lamindb.core.storage.paths import filepath_from_artifact
 
+from ._block_cache import BlockCachedFile, BlockCachedStore
+from ._read_plan import (
+    _is_increasing,
+    _read_csr_rows,
+)
+
 if TYPE_CHECKING:
     from pathlib import Path
 
@@ -149,7 +158,10 @@ def open(filepath: UPath | Path | str):
     fs, file_path_str = infer_filesystem(filepath)
     if isinstance(fs, LocalFileSystem):
         return None, h5py.File(file_path_str, mode="r")
-    conn = fs.open(file_path_str, mode="rb")
+    if settings.backed.block_cache:
+        conn = BlockCachedFile(fs, file_path_str)
+    else:
+        conn = fs.open(file_path_str, mode="rb")
     try:
         storage = h5py.File(conn, mode="r")
     except Exception as e:
@@ -166,11 +178,60 @@ def read_dataframe(elem: h5py.Dataset | h5py.Group):
         return read_elem(elem)
 
 
+def _index_array(idx) -> np.ndarray | None:
+    """Get the positions selected by an integer or boolean array."""
+    if not isinstance(idx, np.ndarray) or idx.ndim != 1:
+        return None
+    if idx.dtype == bool:
+        return np.flatnonzero(idx)
+    if idx.dtype.kind in "iu":
+        return idx.astype(np.int64)
+    return None
+
+
+def _col_array(idx, n_cols: int) -> np.ndarray | None:
+    """Get the selected columns, `None` for all columns."""
+    if isinstance(idx, slice):
+        return None if idx == slice(None) else np.arange(n_cols)[idx]
+    return _index_array(idx)
+
+
+def _read_csr_partial_planned(elem, encoding_type: str, indices):
+    """Read the rows of a csr matrix selected by an array with coalesced slices.
+
+    Returns `None` if the element or the indices are not supported.
+    Dense arrays and dataframes are faster with the h5py point selections.
+    """
+    if encoding_type != "csr_matrix" and not (encoding_type == "" and "indptr" in elem):
+        return None
+    rows = _index_array(indices[0])
+    if rows is None or len(rows) == 0:
+        return None
+    # other column indices, like a scalar, are read with the previous path
+    if not isinstance(indices[1], slice) and _index_array(indices[1]) is None:
+        return None
+    sorted_rows, inverse = np.unique(rows, return_inverse=True)
+    data, col_idxs, indptr = _read_csr_rows(
+        elem["indptr"], elem["data"], elem["indices"], sorted_rows
+    )
+    n_cols = elem.attrs["shape"][1]
+    result = csr_matrix((data, col_idxs, indptr), shape=(len(sorted_rows), n_cols))
+    if not _is_increasing(rows):
+        result = result[inverse]
+    cols = _col_array(indices[1], n_cols)
+    return result if cols is None else result[:, cols]
+
+
 @registry.register("h5py")
-def safer_read_partial(elem, indices):
+def safer_read_partial(elem, indices, items=None):
     is_dataset = isinstance(elem, h5py.Dataset)
     indices_inverse: list | None = None
     encoding_type = get_spec(elem).encoding_type
+    if not is_dataset:
+        # scattered rows of csr matrices are read with coalesced slices
+        result = _read_csr_partial_planned(elem, encoding_type, indices)
+        if result is not None:
+            return result
     # h5py selection for datasets requires sorted indices
     if is_dataset or encoding_type == "dataframe":
         indices_increasing = []
@@ -215,7 +276,7 @@ def safer_read_partial(elem, indices):
                 f" {type(elem).__name__} with an empty spec."
             )
     else:
-        result = read_elem_partial(elem, indices=indices)
+        result = read_elem_partial(elem, items=items, indices=indices)
     if indices_inverse is None:
         return result
     else:
@@ -276,6 +337,8 @@ if ZARR_INSTALLED:
         if isinstance(fs, LocalFileSystem):
             # this is faster than through an fsspec mapper for local
             open_obj = file_path_str
+        elif settings.backed.block_cache and BlockCachedStore is not None:
+            open_obj = BlockCachedStore(file_path_str, fs)
         else:
             open_obj = create_mapper(fs, file_path_str, check=True)
         storage = zarr.open(open_obj, mode="r")
@@ -289,7 +352,7 @@ if ZARR_INSTALLED:
             return read_elem(elem)
 
     @registry.register("zarr")
-    def safer_read_partial(elem, indices):  # noqa
+    def safer_read_partial(elem, indices, items=None):  # noqa
         encoding_type = get_spec(elem).encoding_type
         if encoding_type == "":
             if isinstance(elem, zarr.Array):
@@ -316,7 +379,7 @@ if ZARR_INSTALLED:
                 ds = sparse_dataset(elem)
                 return _subset_sparse(ds, indices)
             else:
-                return read_elem_partial(elem, indices=indices)
+                return read_elem_partial(elem, items=items, indices=indices)
 
     # this is needed because accessing zarr.Group.keys() directly is very slow
     @registry.register("zarr")
@@ -360,6 +423,11 @@ if ZARR_INSTALLED:
         return {attr: keys for attr, keys in attrs_keys.items() if len(keys) > 0}
 
 
+# the attributes which are read by to_dict and to_memory
+_SLOTS = ("X", "obs", "var", "uns", "obsm", "varm", "obsp", "varp", "layers", "raw")
+# the default maximal number of concurrent reads of to_dict and to_memory
+_MAX_READ_WORKERS = 8
+
 ArrayTypes = tuple(ArrayTypes)  # type: ignore
 GroupTypes = tuple(GroupTypes)  # type: ignore
 StorageTypes = tuple(StorageTypes)  # type: ignore
@@ -406,8 +474,8 @@ def _safer_read_index(elem):
                 indices = elem[index_name]
                 break
         if indices is not None and len(indices) > 0:
-            if isinstance(indices[0], bytes):
-                indices = np.frompyfunc(lambda x: x.decode("utf-8"), 1, 1)(indices)
+            if indices.dtype.kind == "S" or isinstance(indices[0], bytes):
+                indices = np.char.decode(indices.astype(bytes), "utf-8")
             return pd.Index(indices)
         else:
             raise ValueError("Indices not found.")
@@ -415,6 +483,47 @@ def _safer_read_index(elem):
         raise ValueError(f"Unknown elem type {type(elem)} when reading indices.")
 
 
+def _safer_index_len(elem) -> int:
+    """Get the length of the index without reading it."""
+    if isinstance(elem, GroupTypes):  # type: ignore
+        index = elem[_read_attr(elem.attrs, "_index")]
+        if isinstance(index, GroupTypes):  # type: ignore
+            # categorical index
+            index = index["codes"]
+        return index.shape[0]
+    elif isinstance(elem, ArrayTypes):  # type: ignore
+        return elem.shape[0]
+    else:
+        raise ValueError(f"Unknown elem type {type(elem)} when reading indices.")
+
+
+def _index_len(idx, n: int) -> int:
+    """Get the number of elements selected by a normalized index."""
+    if isinstance(idx, slice):
+        return len(range(*idx.indices(n)))
+    if isinstance(idx, (int, np.integer)):
+        return 1
+    idx = np.asarray(idx)
+    return int(idx.sum()) if idx.dtype == bool else len(idx)
+
+
+def _has_names(index: Index) -> bool:
+    """Check if the index selects by names."""
+    for idx in unpack_index(index):
+        if isinstance(idx, str):
+            return True
+        if isinstance(idx, slice):
+            if isinstance(idx.start, str) or isinstance(idx.stop, str):
+                return True
+        elif not np.isscalar(idx) and np.asarray(idx).dtype.kind in "OUS":
+            return True
+    return False
+
+
+def _read_key(accessor: _MapAccessor, key: str):
+    return _to_memory(accessor[key])
+
+
 class _MapAccessor:
     def __init__(self, elem, name, indices=None):
         self.elem = elem
@@ -440,9 +549,30 @@ class _MapAccessor:
 class _AnnDataAttrsMixin:
     storage: StorageType
     _attrs_keys: Mapping[str, list]
+    _obs_names: pd.Index
+    _var_names: pd.Index
+    shape: tuple[int, int]
+    raw: AnnDataRawAccessor | None
 
     @cached_property
     def obs(self) -> pd.DataFrame:
+        return self._read_obs()
+
+    @cached_property
+    def var(self) -> pd.DataFrame:
+        return self._read_var()
+
+    @cached_property
+    def uns(self):
+        return self._read_uns()
+
+    @cached_property
+    def X(self):
+        return self._read_X()
+
+    # the reads are separate from the cached properties to run them concurrently,
+    # cached_property locks all instances of a class before python 3.12
+    def _read_obs(self) -> pd.DataFrame:
         if "obs" not in self._attrs_keys:
             return None
         indices = getattr(self, "indices", None)
@@ -453,8 +583,7 @@ class _AnnDataAttrsMixin:
         else:
             return registry.read_dataframe(self.storage["obs"])  # type: ignore
 
-    @cached_property
-    def var(self) -> pd.DataFrame:
+    def _read_var(self) -> pd.DataFrame:
         if "var" not in self._attrs_keys:
             return None
         indices = getattr(self, "indices", None)
@@ -465,14 +594,47 @@ class _AnnDataAttrsMixin:
         else:
             return registry.read_dataframe(self.storage["var"])  # type: ignore
 
-    @cached_property
-    def uns(self):
+    def obs_columns(self, columns: str | list[str]) -> pd.DataFrame:
+        """Read only these columns of `.obs`.
+
+        Subsets read only the selected observations.
+        """
+        return self._read_columns("obs", columns)
+
+    def var_columns(self, columns: str | list[str]) -> pd.DataFrame:
+        """Read only these columns of `.var`.
+
+        Subsets read only the selected variables.
+        """
+        return self._read_columns("var", columns)
+
+    def _read_columns(self, attr: str, columns: str | list[str]) -> pd.DataFrame:
+        if isinstance(columns, str):
+            columns = [columns]
+        if attr in self.__dict__:
+            return self.__dict__[attr][columns]
+        elem = self.storage[attr]  # type: ignore
+        is_records = isinstance(elem, ArrayTypes)  # type: ignore
+        if is_records or get_spec(elem).encoding_type != "dataframe":
+            # the columns of legacy record arrays can't be read separately
+            return getattr(self, attr)[columns]
+        indices = getattr(self, "indices", None)
+        if indices is None:
+            df = read_elem_partial(elem, items=columns)
+        else:
+            idx = indices[0] if attr == "obs" else indices[1]
+            df = registry.safer_read_partial(
+                elem, indices=(idx, slice(None)), items=columns
+            )
+        # the columns are read in the order of the file
+        return df[columns]
+
+    def _read_uns(self):
         if "uns" not in self._attrs_keys:
             return None
         return read_elem(self.storage["uns"])
 
-    @cached_property
-    def X(self):
+    def _read_X(self):
         indices = getattr(self, "indices", None)
         if indices is not None:
             return registry.safer_read_partial(self.storage["X"], indices=indices)
@@ -530,36 +692,83 @@ class _AnnDataAttrsMixin:
     def var_names(self):
         return self._var_names
 
-    @cached_property
-    def shape(self):
-        return len(self._obs_names), len(self._var_names)
-
-    def to_dict(self):
-        prepare_adata = {}
-
-        prepare_adata["X"] = _to_memory(self.X)
-
-        if "uns" in self._attrs_keys:
-            prepare_adata["uns"] = self.uns
-
-        for attr in ("obs", "var"):
-            if attr in self._attrs_keys:
-                prepare_adata[attr] = getattr(self, attr)
-
+    def _normalize_indices(self, index: Index):
+        # the names are read only if the index selects by names
+        if _has_names(index):
+            return _normalize_indices(index, self._obs_names, self._var_names)
+        n_obs, n_vars = self.shape
+        return _normalize_indices(index, pd.RangeIndex(n_obs), pd.RangeIndex(n_vars))
+
+    def _subset_names(self, attr: str, idx):
+        # subset the names only if they were already read
+        names = self.__dict__.get(attr)
+        return None if names is None else names[idx]
+
+    def _read_cached(self, attr: str):
+        # use the cached property if it was already computed
+        if attr not in self.__dict__:
+            self.__dict__[attr] = getattr(self, f"_read_{attr}")()
+        return self.__dict__[attr]
+
+    def to_dict(self, slots: list[str] | None = None, max_workers: int | None = None):
+        """Read the attributes into memory concurrently.
+
+        Args:
+            slots: Read only these attributes, for example ``["X", "obs", "obsm"]``.
+                If ``None``, reads all attributes.
+            max_workers: The maximal number of concurrent reads,
+                ``_MAX_READ_WORKERS`` if ``None``.
+        """
+        if slots is None:
+            slots = list(_SLOTS)
+        elif not set(slots) <= set(_SLOTS):
+            raise ValueError(f"`slots` should be in {_SLOTS}.")
+        # the reads of the elements are independent
+        reads = {}
+        if "X" in slots:
+            reads[("X", None)] = lambda: _to_memory(self._read_cached("X"))
+        for attr in ("uns", "obs", "var"):
+            if attr in slots and attr in self._attrs_keys:
+                reads[(attr, None)] = partial(self._read_cached, attr)
         for attr in ("obsm", "varm", "obsp", "varp", "layers"):
-            if attr in self._attrs_keys:
-                prepare_adata[attr] = {}
+            if attr in slots and attr in self._attrs_keys:
                 get_attr = getattr(self, attr)
                 for key in self._attrs_keys[attr]:
-                    prepare_adata[attr][key] = _to_memory(get_attr[key])
-
-        if "raw" in self._attrs_keys:
-            prepare_adata["raw"] = self.raw.to_dict()
-
+                    reads[(attr, key)] = partial(_read_key, get_attr, key)
+        if "raw" in slots and "raw" in self._attrs_keys:
+            reads[("raw", None)] = lambda: self.raw.to_dict(max_workers=max_workers)
+
+        if max_workers is None:
+            max_workers = _MAX_READ_WORKERS
+        n_workers = max(1, min(max_workers, len(reads)))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {key: executor.submit(read) for key, read in reads.items()}
+            results = {key: future.result() for key, future in futures.items()}
+
+        prepare_adata: dict = {}
+        for (attr, key), result in results.items():
+            if key is None:
+                prepare_adata[attr] = result
+            else:
+                prepare_adata.setdefault(attr, {})[key] = result
         return prepare_adata
 
-    def to_memory(self):
-        adata = AnnData(**self.to_dict())
+    def to_memory(self, slots: list[str] | None = None, max_workers: int | None = None):
+        """Read into an `AnnData` object.
+
+        Args:
+            slots: Read only these attributes, for example ``["X", "obs", "obsm"]``.
+                If ``None``, reads all attributes.
+            max_workers: The maximal number of concurrent reads.
+        """
+        prepare_adata = self.to_dict(slots, max_workers)
+        if slots is not None:
+            # keep the names of the observations and the variables
+            for attr in ("obs", "var"):
+                if attr not in prepare_adata:
+                    names = getattr(self, f"{attr}_names")
+                    prepare_adata[attr] = pd.DataFrame(index=names)
+        adata = AnnData(**prepare_adata)
         return adata
 
 
@@ -569,14 +778,38 @@ class AnnDataAccessorSubset(_AnnDataAttrsMixin):
         self.indices = indices
 
         self._attrs_keys = attrs_keys
-        self._obs_names, self._var_names = obs_names, var_names
+        # if not passed, the names are read on first access
+        if obs_names is not None:
+            self._obs_names = obs_names
+        if var_names is not None:
+            self._var_names = var_names
 
         self._ref_shape = ref_shape
 
+    @cached_property
+    def _obs_names(self):
+        names = _safer_read_index(self.storage["obs"])
+        return names if self.indices is None else names[self.indices[0]]
+
+    @cached_property
+    def _var_names(self):
+        names = _safer_read_index(self.storage["var"])
+        return names if self.indices is None else names[self.indices[1]]
+
+    @cached_property
+    def shape(self):
+        if self.indices is None:
+            return len(self._obs_names), len(self._var_names)
+        return (
+            _index_len(self.indices[0], self._ref_shape[0]),
+            _index_len(self.indices[1], self._ref_shape[1]),
+        )
+
     def __getitem__(self, index: Index):
         """Access a subset of the underlying AnnData object."""
-        oidx, vidx = _normalize_indices(index, self._obs_names, self._var_names)
-        new_obs_names, new_var_names = self._obs_names[oidx], self._var_names[vidx]
+        oidx, vidx = self._normalize_indices(index)
+        new_obs_names = self._subset_names("_obs_names", oidx)
+        new_var_names = self._subset_names("_var_names", vidx)
         if self.indices is not None:
             oidx = _resolve_idx(self.indices[0], oidx, self._ref_shape[0])
             vidx = _resolve_idx(self.indices[1], vidx, self._ref_shape[1])
@@ -668,11 +901,23 @@ class AnnDataAccessor(_AnnDataAttrsMixin):
 
         self._name = filename
 
-        self._obs_names = _safer_read_index(self.storage["obs"])  # type: ignore
-        self._var_names = _safer_read_index(self.storage["var"])  # type: ignore
-
         self._closed = False
 
+    @cached_property
+    def _obs_names(self):
+        return _safer_read_index(self.storage["obs"])  # type: ignore
+
+    @cached_property
+    def _var_names(self):
+        return _safer_read_index(self.storage["var"])  # type: ignore
+
+    @cached_property
+    def shape(self):
+        return (
+            _safer_index_len(self.storage["obs"]),  # type: ignore
+            _safer_index_len(self.storage["var"]),  # type: ignore
+        )
+
     def close(self):
         """Closes the connection."""
         if hasattr(self, "storage") and hasattr(self.storage, "close"):
@@ -693,8 +938,9 @@ class AnnDataAccessor(_AnnDataAttrsMixin):
 
     def __getitem__(self, index: Index) -> AnnDataAccessorSubset:
         """Access a subset of the underlying AnnData object."""
-        oidx, vidx = _normalize_indices(index, self._obs_names, self._var_names)
-        new_obs_names, new_var_names = self._obs_names[oidx], self._var_names[vidx]
+        oidx, vidx = self._normalize_indices(index)
+        new_obs_names = self._subset_names("_obs_names", oidx)
+        new_var_names = self._subset_names("_var_names", vidx)
         return AnnDataAccessorSubset(
             self.storage,
             (oidx, vidx),
@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from lamindb_setup import settings as setup_settings
+
+from lamindb.core._settings import settings
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from fsspec import AbstractFileSystem
+
+
+class _BlockCache:
+    """LRU cache of fetched blocks bounded by the number of bytes.
+
+    Blocks are optionally also written to a directory and read from there on a miss,
+    the directory is bounded by the number of bytes too, the files which
+    weren't read for the longest time are removed first.
+    """
+
+    def __init__(self):
+        self._blocks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self._disk_lock = threading.Lock()
+        # bytes in the directory, counted on the first write
+        self._disk_nbytes: int | None = None
+
+    @staticmethod
+    def _cache_dir() -> Path:
+        return setup_settings.storage.cache_dir / "backed_blocks"
+
+    def _block_path(self, key: tuple) -> Path:
+        digest = hashlib.sha1(repr(key[:-1]).encode()).hexdigest()
+        return self._cache_dir() / digest / str(key[-1])
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+        if not settings.backed.persist:
+            return None
+        path = self._block_path(key)
+        try:
+            block = path.read_bytes()
+            # mark as recently used for the eviction from the directory
+            os.utime(path)
+        except FileNotFoundError:
+            # also if removed by another session
+            return None
+        self._add(key, block)
+        return block
+
+    def put(self, key: tuple, block: bytes):
+        self._add(key, block)
+        if settings.backed.persist and len(block) <= settings.backed.max_disk_bytes:
+            path = self._block_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first for concurrent sessions
+            tmp_path = path.with_name(
+                f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            tmp_path.write_bytes(block)
+            tmp_path.replace(path)
+            self._add_disk(len(block))
+
+    def _add(self, key: tuple, block: bytes):
+        max_bytes = settings.backed.max_bytes
+        if len(block) > max_bytes:
+            return
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self.nbytes += len(block)
+            while self.nbytes > max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def _add_disk(self, nbytes: int):
+        with self._disk_lock:
+            if self._disk_nbytes is None:
+                self._disk_nbytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_nbytes += nbytes
+            if self._disk_nbytes > settings.backed.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_files(self) -> list[tuple[float, int, Path]]:
+        """Get the modification time, the size and the path of the block files."""
+        files = []
+        for path in self._cache_dir().glob("*/*"):
+            # the temporary files are being written
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict_disk(self):
+        """Remove the least recently used files until the directory fits.
+
+        Counts all files again, other sessions can write to the same directory.
+        """
+        files = sorted(self._disk_files(), key=lambda file: file[0])
+        nbytes = sum(size for _, size, _ in files)
+        max_disk_bytes = settings.backed.max_disk_bytes
+        for _, size, path in files:
+            if nbytes <= max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            nbytes -= size
+            try:
+                path.parent.rmdir()
+            except OSError:
+                # not empty
+                pass
+        self._disk_nbytes = nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+
+block_cache = _BlockCache()
+
+
+def _file_version(info: dict) -> str | None:
+    """Get an identifier of the version of a cloud file from its info."""
+    for key in ("ETag", "etag", "md5Hash", "LastModified", "mtime", "updated"):
+        if info.get(key) is not None:
+            return str(info[key])
+    return None
+
+
+class BlockCachedFile(io.RawIOBase):
+    """Read-only file object which reads a cloud file in cached blocks.
+
+    Reads are split into blocks aligned to ``block_size``, the missing blocks of a read
+    are fetched with one range request together with up to ``readahead`` following
+    blocks. Small scattered reads, like those of the metadata of HDF5 files,
+    then cost a few requests.
+    """
+
+    def __init__(
+        self,
+        fs: AbstractFileSystem,
+        path: str,
+        block_size: int | None = None,
+        readahead: int | None = None,
+    ):
+        self.fs = fs
+        self.path = path
+        if block_size is None:
+            block_size = settings.backed.block_size
+        if readahead is None:
+            readahead = settings.backed.readahead
+        self.block_size = block_size
+        self.readahead = readahead
+        if block_size < 1 or readahead < 0:
+            raise ValueError(
+                "`block_size` should be positive and `readahead` non-negative."
+            )
+        info = fs.info(path)
+        self.size = info["size"]
+        self._key = (fs.protocol, path, self.size, _file_version(info), self.block_size)
+        self._n_blocks = -(-self.size // self.block_size)
+        self._pos = 0
+        self.n_requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}.")
+        if pos < 0:
+            raise ValueError("Negative seek position.")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        start = min(self._pos, self.size)
+        end = min(start + len(buffer), self.size)
+        if end <= start:
+            return 0
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        blocks = self._get_blocks(first, last)
+        data = b"".join(blocks)
+        offset = start - first * self.block_size
+        n_read = end - start
+        memoryview(buffer)[:n_read] = data[offset : offset + n_read]
+        self._pos = end
+        return n_read
+
+    def _get_blocks(self, first: int, last: int) -> list[bytes]:
+        blocks = {i: block_cache.get((*self._key, i)) for i in range(first, last + 1)}
+        i = first
+        while i <= last:
+            if blocks[i] is not None:
+                i += 1
+                continue
+            # fetch the run of missing blocks and read ahead
+            end = i
+            while end <= last and blocks[end] is None:
+                end += 1
+            if end > last:
+                end = min(end + self.readahead, self._n_blocks)
+            fetched = self._fetch(i, end)
+            for j, block in zip(range(i, end), fetched):
+                if j <= last:
+                    blocks[j] = block
+            i = end
+        return [blocks[i] for i in range(first, last + 1)]
+
+    def _fetch(self, first: int, end: int) -> list[bytes]:
+        """Fetch the blocks `[first, end)` with one request and cache them."""
+        start = first * self.block_size
+        data = self.fs.cat_file(
+            self.path, start=start, end=min(end * self.block_size, self.size)
+        )
+        self.n_requests += 1
+        fetched = []
+        for j in range(first, end):
+            offset = (j - first) * self.block_size
+            block = data[offset : offset + self.block_size]
+            block_cache.put((*self._key, j), block)
+            fetched.append(block)
+        return fetched
+
+
+# the metadata objects of zarr stores, which are not cached
+_ZARR_METADATA = (".zmetadata", ".zgroup", ".zattrs", ".zarray")
+
+
+try:
+    from zarr.storage import FSStore
+except ImportError:
+    BlockCachedStore = None
+else:
+
+    class BlockCachedStore(FSStore):  # type: ignore
+        """Read-only zarr store which caches the objects of a cloud store.
+
+        Every chunk is an object in the cloud and is cached as one block,
+        the chunks are identified by their paths and the version of the ``.zarray``
+        of their array, which is rewritten when the array is written again.
+        The versions are looked up once per store, chunks of arrays without
+        a version and the metadata objects are always read from the cloud.
+        """
+
+        def __init__(self, url: str, fs: AbstractFileSystem):
+            super().__init__(url, fs=fs, mode="r")
+            self._key = (fs.protocol, self.path)
+            # the versions of the arrays by the directories of the chunks
+            self._versions: dict[str, str | None] = {}
+
+        def _version(self, key: str) -> str | None:
+            """Get the version of the array of the chunk `key`."""
+            chunk_dir = key.rpartition("/")[0]
+            if chunk_dir in self._versions:
+                return self._versions[chunk_dir]
+            version = None
+            # the chunks can be nested in directories with the "/" separator
+            array_dir = chunk_dir
+            while True:
+                prefix = f"{self.path}/{array_dir}" if array_dir else self.path
+                try:
+                    info = self.fs.info(f"{prefix}/.zarray")
+                except FileNotFoundError:
+                    if not array_dir:
+                        break
+                    array_dir = array_dir.rpartition("/")[0]
+                    continue
+                version = _file_version(info)
+                break
+            self._versions[chunk_dir] = version
+            return version
+
+        def _block_key(self, key: str) -> tuple | None:
+            """Get the key of the chunk in the cache, `None` if it isn't cached."""
+            if key.rpartition("/")[2] in _ZARR_METADATA:
+                return None
+            version = self._version(key)
+            if version is None:
+                return None
+            return (*self._key, version, key)
+
+        def __getitem__(self, key):
+            block_key = self._block_key(key)
+            if block_key is None:
+                return super().__getitem__(key)
+            block = block_cache.get(block_key)
+            if block is None:
+                block = super().__getitem__(key)
+                block_cache.put(block_key, block)
+            return block
+
+        def getitems(self, keys, **kwargs):
+            result = {}
+            missing = []
+            block_keys = {key: self._block_key(key) for key in keys}
+            for key, block_key in block_keys.items():
+                block = None if block_key is None else block_cache.get(block_key)
+                if block is None:
+                    missing.append(key)
+                else:
+                    result[key] = block
+            if missing:
+                fetched = super().getitems(missing, **kwargs)
+                for key, block in fetched.items():
+                    block_key = block_keys.get(key)
+                    if block_key is not None:
+                        block_cache.put(block_key, block)
+                result.update(fetched)
+            return result
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from ._backed_access import ArrayType
+
+
+# gaps between requested ranges up to this number of elements
+# are read instead of being skipped with a separate request
+_MAX_GAP = 4096
+# columns are read in blocks with gaps up to this number of columns,
+# if there are more blocks, all columns between the first and the last one are read
+_MAX_COL_GAP = 64
+_MAX_COL_BLOCKS = 16
+
+
+def _coalesce_ranges(starts: np.ndarray, ends: np.ndarray, max_gap: int):
+    """Merge sorted half-open ranges with gaps not larger than `max_gap` into runs.
+
+    Returns the starts and the ends of the runs and the run index for each range.
+    """
+    new_run = np.empty(len(starts), dtype=bool)
+    new_run[:1] = True
+    new_run[1:] = (starts[1:] - ends[:-1]) > max_gap
+    run_ids = np.cumsum(new_run) - 1
+    run_starts = starts[new_run]
+    run_ends = np.maximum.reduceat(ends, np.flatnonzero(new_run))
+    return run_starts, run_ends, run_ids
+
+
+def _read_runs(
+    array: ArrayType,  # type: ignore
+    run_starts: np.ndarray,
+    run_ends: np.ndarray,
+    col_blocks: list | None = None,
+):
+    """Read each run with one slice, concatenate along the first axis.
+
+    Reads only `col_blocks` of the second axis if passed.
+    Returns the concatenated runs and the offset of each run in the result.
+    """
+    if col_blocks is None:
+        chunks = [array[start:end] for start, end in zip(run_starts, run_ends)]  # type: ignore
+    else:
+        chunks = [
+            np.concatenate(
+                [array[start:end, c_start:c_end] for c_start, c_end in col_blocks],  # type: ignore
+                axis=1,
+            )
+            for start, end in zip(run_starts, run_ends)
+        ]
+    offsets = np.zeros(len(chunks), dtype=np.int64)
+    np.cumsum((run_ends - run_starts)[:-1], out=offsets[1:])
+    if len(chunks) == 1:
+        return chunks[0], offsets
+    return np.concatenate(chunks), offsets
+
+
+def _read_ranges(
+    array: ArrayType,  # type: ignore
+    starts: np.ndarray,
+    ends: np.ndarray,
+    max_gap: int = _MAX_GAP,
+    cols: np.ndarray | None = None,
+):
+    """Read sorted non-overlapping half-open ranges with coalesced slices.
+
+    Reads only the sorted unique columns `cols` of a 2d array if passed.
+    Returns the values of all ranges concatenated along the first axis.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    lengths = ends - starts
+    if len(starts) == 0 or lengths.sum() == 0:
+        empty = array[0:0]  # type: ignore
+        return empty if cols is None else empty[:, cols]
+    run_starts, run_ends, run_ids = _coalesce_ranges(starts, ends, max_gap)
+    if cols is None:
+        buffer, run_offsets = _read_runs(array, run_starts, run_ends)
+    else:
+        col_blocks, col_select = _plan_col_blocks(cols)
+        buffer, run_offsets = _read_runs(array, run_starts, run_ends, col_blocks)
+        if col_select is not None:
+            buffer = buffer[:, col_select]
+    if lengths.sum() == len(buffer):
+        return buffer
+    offsets = run_offsets[run_ids] + starts - run_starts[run_ids]
+    return buffer[_arange_ranges(offsets, lengths)]
+
+
+def _is_increasing(idxs: np.ndarray) -> bool:
+    return len(idxs) < 2 or bool(np.all(np.diff(idxs) > 0))
+
+
+def _read_rows(
+    array: ArrayType,  # type: ignore
+    rows: np.ndarray,
+    cols: np.ndarray | None = None,
+):
+    """Read rows in any order and with repetitions with coalesced slices.
+
+    Reads only the columns `cols` of a 2d array if passed, also in any order.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    rows_inverse = None
+    if not _is_increasing(rows):
+        rows, rows_inverse = np.unique(rows, return_inverse=True)
+    cols_inverse = None
+    if cols is None:
+        row_size = int(np.prod(array.shape[1:]))  # type: ignore
+    else:
+        cols = np.asarray(cols, dtype=np.int64)
+        if not _is_increasing(cols):
+            cols, cols_inverse = np.unique(cols, return_inverse=True)
+        row_size = len(cols)
+    # the gaps are measured in elements, not in rows
+    max_gap = _MAX_GAP // max(row_size, 1)
+    result = _read_ranges(array, rows, rows + 1, max_gap, cols)
+    if rows_inverse is not None:
+        result = result[rows_inverse]
+    if cols_inverse is not None:
+        result = result[:, cols_inverse]
+    return result
+
+
+def _plan_col_blocks(cols: np.ndarray):
+    """Coalesce sorted unique columns into blocks of contiguous columns.
+
+    Returns the blocks and the positions of `cols` in the concatenated blocks,
+    `None` if the blocks contain only `cols`.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    if len(cols) == 0:
+        return [(0, 0)], None
+    starts, ends, block_ids = _coalesce_ranges(cols, cols + 1, _MAX_COL_GAP)
+    if len(starts) > _MAX_COL_BLOCKS:
+        starts, ends = cols[:1], cols[-1:] + 1
+        block_ids = np.zeros(len(cols), dtype=np.int64)
+    blocks = list(zip(starts.tolist(), ends.tolist()))
+    if (ends - starts).sum() == len(cols):
+        return blocks, None
+    offsets = np.zeros(len(starts), dtype=np.int64)
+    np.cumsum((ends - starts)[:-1], out=offsets[1:])
+    return blocks, offsets[block_ids] + cols - starts[block_ids]
+
+
+def _arange_ranges(starts: np.ndarray, lengths: np.ndarray):
+    """Concatenate `np.arange(start, start + length)` for all ranges."""
+    gather = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    gather += np.arange(len(gather))
+    return gather
+
+
+def _read_csr_rows(
+    indptr: ArrayType,  # type: ignore
+    data: ArrayType,  # type: ignore
+    indices: ArrayType,  # type: ignore
+    rows: np.ndarray,
+):
+    """Read sorted unique rows of a csr matrix with coalesced slices.
+
+    Returns `data`, `indices` and `indptr` of the rows.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) == 0:
+        return data[0:0], indices[0:0], np.zeros(1, dtype=np.int64)  # type: ignore
+    # read indptr[row : row + 2] for all rows with coalesced slices
+    run_starts, run_ends, run_ids = _coalesce_ranges(rows, rows + 2, _MAX_GAP)
+    indptr_runs, run_offsets = _read_runs(indptr, run_starts, run_ends)
+    indptr_pos = run_offsets[run_ids] + rows - run_starts[run_ids]
+    starts, ends = indptr_runs[indptr_pos], indptr_runs[indptr_pos + 1]
+    row_data = _read_ranges(data, starts, ends)
+    row_indices = _read_ranges(indices, starts, ends)
+    row_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=row_indptr[1:])
+    return row_data, row_indices, row_indptr
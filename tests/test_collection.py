@@ -1,4 +1,6 @@
+import pickle
 from inspect import signature
+from multiprocessing import AuthenticationError
 
 import anndata as ad
 import bionty as bt
@@ -213,6 +215,9 @@ def test_collection_mapped(adata, adata2):
         assert ls_ds[1]["feat1"] == 0
         assert ls_ds[0]["feat2"] == -1
         assert ls_ds[1]["feat2"] == 0
+        assert ls_ds._obs_codes["feat1"][0].dtype == np.int32
+        assert np.array_equal(ls_ds._obs_codes["feat1"][1], np.array([-1, 0]))
+        assert ls_ds.get_merged_labels("feat1").tolist() == ["A", "B", "A", "B"]
     with collection.mapped(
         obs_keys=["feat1", "feat2"], unknown_label={"feat1": "A"}
     ) as ls_ds:
@@ -250,6 +255,50 @@ def test_collection_mapped(adata, adata2):
     assert all(weights[1:] == weights[0])
     weights = ls_ds.get_label_weights(["feat1", "feat2"])
     assert all(weights[1:] == weights[0])
+    sampler = ln.core.BlockShuffleSampler(ls_ds, block_size=1, buffer_size=2, seed=0)
+    assert len(sampler) == 4
+    assert sorted(sampler) == [0, 1, 2, 3]
+    assert list(sampler) == list(sampler)
+    sampler = ln.core.ClassBalancedSampler(ls_ds, obs_keys="feat1", seed=0)
+    assert len(sampler) == 4
+    assert set(sampler) <= {0, 1, 2, 3}
+    assert list(sampler) == list(sampler)
+    for block_size in (None, 1):
+        sampler = ln.core.PermutationSampler(ls_ds, block_size=block_size, seed=0)
+        idxs = list(sampler)
+        assert sorted(idxs) == [0, 1, 2, 3]
+        sampler.set_epoch(0, start=3)
+        assert len(sampler) == 1
+        assert list(sampler) == idxs[3:]
+    samplers = [ln.core.ShardSampler(ls_ds, rank=r, world_size=2) for r in range(2)]
+    assert len(samplers[0]) == 2
+    assert sorted(list(samplers[0]) + list(samplers[1])) == [0, 1, 2, 3]
+    # every rank reads one file
+    assert len(samplers[0].get_ranges()[0]) == 1
+    batches = list(ln.core.MappedStream(ls_ds, batch_size=3, chunk_size=1))
+    assert [len(batch["X"]) for batch in batches] == [3, 1]
+    assert sorted(np.concatenate([batch["X"][:, 2] for batch in batches])) == [
+        3,
+        5,
+        6,
+        8,
+    ]
+    # the ranks return the same numbers of rows and batches for uneven files
+    uneven_path = ln.settings.storage.cache_dir / "mapped_uneven.h5ad"
+    ad.concat([adata, adata2, adata]).write_h5ad(uneven_path)
+    with ln.core.MappedCollection([uneven_path, *collection.cache()]) as uneven_ds:
+        for drop_last, batch_lens in ((False, [3, 1]), (True, [3])):
+            for rank in range(3):
+                stream = ln.core.MappedStream(
+                    uneven_ds,
+                    batch_size=3,
+                    chunk_size=2,
+                    rank=rank,
+                    world_size=3,
+                    drop_last=drop_last,
+                )
+                assert [len(batch["X"]) for batch in stream] == batch_lens
+    uneven_path.unlink()
     ls_ds.close()
     assert ls_ds.closed
     del ls_ds
@@ -302,11 +351,174 @@ def test_collection_mapped(adata, adata2):
         assert np.issubdtype(ls_ds[2]["X"].dtype, np.integer)
         assert np.issubdtype(ls_ds[4]["X"].dtype, np.integer)
         assert np.array_equal(ls_ds[3]["obsm_X_pca"], np.array([3, 4]))
+        batch = ls_ds.get_batch([5, 0, 4, 0])
+        assert batch["X"].shape == (4, 6)
+        assert np.array_equal(batch["X"][0], np.array([4, 5, 8, 0, 0, 0]))
+        assert np.array_equal(batch["X"][1], np.array([0, 0, 0, 3, 1, 2]))
+        assert np.array_equal(batch["X"][3], batch["X"][1])
+        assert np.array_equal(batch["obsm_X_pca"][2], np.array([1, 2]))
+        assert np.array_equal(batch["_store_idx"], np.array([2, 0, 2, 0]))
+        assert batch["feat1"][0] == ls_ds.encoders["feat1"]["B"]
+        assert all(batch["feat1"][1:] == ls_ds.encoders["feat1"]["A"])
+        batch = ls_ds.get_batch([])
+        assert batch["X"].shape == (0, 6)
+        assert batch["X"].dtype == ls_ds[0]["X"].dtype
+        assert batch["obsm_X_pca"].shape == (0, 2)
+        assert len(batch["feat1"]) == 0
+        assert len(batch["_store_idx"]) == 0
+        samples = ls_ds.__getitems__([2, 3])
+        assert len(samples) == 2
+        assert np.array_equal(samples[1]["X"], ls_ds[3]["X"])
+        assert all(var_idxs.dtype == np.int8 for var_idxs in ls_ds.var_indices)
+        assert np.array_equal(ls_ds.storage_idx, np.array([0, 0, 1, 1, 2, 2]))
+        assert np.array_equal(ls_ds.indices, np.array([0, 1, 0, 1, 0, 1]))
+        assert np.array_equal(ls_ds[-1]["X"], ls_ds[5]["X"])
+        with pytest.raises(IndexError):
+            ls_ds[6]
 
     with collection_outer.mapped(layers_keys="layer1", join="outer") as ls_ds:
         assert np.array_equal(ls_ds[0]["layer1"], np.array([0, 0, 0, 3, 0, 2]))
         assert np.array_equal(ls_ds[4]["layer1"], np.array([1, 2, 5, 0, 0, 0]))
 
+    with ln.core.MappedCollection(
+        collection_outer.cache(), obs_keys="feat1", join="outer", max_open_files=1
+    ) as ls_ds:
+        assert len(ls_ds._handles) == 1
+        assert np.array_equal(ls_ds[0]["X"], np.array([0, 0, 0, 3, 1, 2]))
+        assert np.array_equal(ls_ds[5]["X"], np.array([4, 5, 8, 0, 0, 0]))
+        assert ls_ds.get_batch([0, 5])["X"].shape == (2, 6)
+        assert len(ls_ds._handles) == 1
+    assert len(ls_ds._handles) == 0
+
+    with ln.core.MappedCollection(
+        collection_outer.cache(), obs_keys="feat1", join="outer", sparse=True
+    ) as ls_ds:
+        batch = ls_ds.get_batch([0, 4])
+        assert isinstance(batch["X"], csr_matrix)
+        assert np.array_equal(batch["X"].toarray()[0], np.array([0, 0, 0, 3, 1, 2]))
+        assert np.array_equal(batch["X"].toarray()[1], np.array([1, 2, 5, 0, 0, 0]))
+        assert ls_ds[5]["X"].shape == (1, 6)
+        assert np.array_equal(ls_ds[[5]]["X"].toarray(), ls_ds[5]["X"].toarray())
+
+    with ln.core.MappedCollection(
+        collection.cache(), obs_keys="feat1", obs_filter={"feat1": "B"}
+    ) as ls_ds:
+        assert len(ls_ds) == 2
+        assert ls_ds.original_shapes == [(2, 3), (2, 3)]
+        assert np.array_equal(ls_ds[0]["X"], np.array([4, 5, 6]))
+        assert np.array_equal(ls_ds[1]["X"], np.array([4, 5, 8]))
+        assert np.array_equal(ls_ds.get_batch([1, 0])["X"][0], np.array([4, 5, 8]))
+        assert ls_ds.get_merged_labels("feat1").tolist() == ["B", "B"]
+    with ln.core.MappedCollection(
+        collection.cache(), obs_filter={"feat2": lambda labels: labels == "A"}
+    ) as ls_ds:
+        assert len(ls_ds) == 2
+        assert np.array_equal(ls_ds[1]["X"], np.array([1, 2, 5]))
+    with ln.core.MappedCollection(
+        collection.cache(),
+        transforms=[ln.core.NormalizeTotal(6.0), ln.core.Log1p(), ln.core.Clip(0, 1)],
+    ) as ls_ds:
+        X = ls_ds.get_batch([0, 2])["X"]
+        assert np.allclose(X[0], np.clip(np.log1p([1, 2, 3]), 0, 1))
+        assert np.allclose(ls_ds[2]["X"], X[1])
+        assert np.allclose(X[1], np.clip(np.log1p(np.array([1, 2, 5]) * 6 / 8), 0, 1))
+    # the transforms don't change the arrays of the caller
+    X = np.array([[1.0, 3.0]])
+    assert np.allclose(ln.core.NormalizeTotal(1.0)(X), np.array([[0.25, 0.75]]))
+    assert np.array_equal(X, np.array([[1.0, 3.0]]))
+    X_csr = csr_matrix(X)
+    ln.core.NormalizeTotal(1.0)(X_csr)
+    assert np.array_equal(X_csr.toarray(), X)
+    with pytest.raises(ValueError):
+        ln.core.Clip()
+
+    with ln.core.MappedCollection(
+        collection_outer.cache(), join="outer", var_subset=["MYC", "A"]
+    ) as ls_ds:
+        assert ls_ds.shape == (6, 2)
+        assert np.array_equal(ls_ds[0]["X"], np.array([1, 0]))
+        assert np.array_equal(ls_ds[4]["X"], np.array([0, 1]))
+        assert np.array_equal(ls_ds.get_batch([2, 5])["X"], np.array([[1, 0], [0, 4]]))
+
+    with ln.core.MappedCollection(
+        collection_outer.cache(), join="outer", chunk_cache_size=10**6
+    ) as ls_ds:
+        assert np.array_equal(ls_ds[2]["X"], np.array([0, 0, 0, 5, 1, 2]))
+        assert ls_ds.chunk_cache_info()["misses"] > 0
+        assert np.array_equal(ls_ds[3]["X"], np.array([0, 0, 0, 8, 4, 5]))
+        assert ls_ds.chunk_cache_info()["hits"] > 0
+        batches = list(ls_ds.iter_batches([[0, 1], [2, 3], [5]], prefetch=1))
+        assert len(batches) == 3
+        assert np.array_equal(batches[1]["X"], ls_ds.get_batch([2, 3])["X"])
+        assert np.array_equal(batches[2]["X"], np.array([[4, 5, 8, 0, 0, 0]]))
+        # the arguments are checked on the call, not on the first batch
+        with pytest.raises(ValueError):
+            ls_ds.iter_batches([[0, 1]], prefetch=0)
+        loader = ln.core.ThreadedLoader(ls_ds, batch_size=4, n_threads=2)
+        assert len(loader) == 2
+        batches = list(loader)
+        assert [len(batch["X"]) for batch in batches] == [4, 2]
+        assert np.array_equal(batches[1]["X"], ls_ds.get_batch([4, 5])["X"])
+        address = ln.settings.storage.cache_dir / "mapped.sock"
+        key_path = address.with_name("mapped.sock.key")
+        with ln.core.MappedServer(ls_ds, address):
+            assert address.stat().st_mode & 0o777 == 0o600
+            assert key_path.stat().st_mode & 0o777 == 0o600
+            with pytest.raises(AuthenticationError):
+                ln.core.MappedClient(address, authkey=b"wrong")
+            with ln.core.MappedClient(address) as client:
+                assert client.shape == ls_ds.shape
+                assert np.array_equal(
+                    client.get_batch([5, 1])["X"], ls_ds.get_batch([5, 1])["X"]
+                )
+                assert np.array_equal(client[2]["X"], ls_ds[2]["X"])
+                assert client.chunk_cache_info()["hits"] > 0
+        assert not address.exists()
+        assert not key_path.exists()
+    with pytest.raises(ValueError):
+        ln.core.MappedCollection(collection_outer.cache(), var_subset=["MYC", "A"])
+
+    state_path = ln.settings.storage.cache_dir / "mapped_state.pkl"
+    with ln.core.MappedCollection(
+        collection_outer.cache(), obs_keys="feat1", join="outer", state_path=state_path
+    ) as ls_ds:
+        var_joint = ls_ds.var_joint
+        encoders = ls_ds.encoders
+    assert state_path.exists()
+    with ln.core.MappedCollection(
+        collection_outer.cache(), obs_keys="feat1", join="outer", state_path=state_path
+    ) as ls_ds:
+        assert ls_ds.var_joint.equals(var_joint)
+        assert ls_ds.encoders == encoders
+        assert ls_ds.n_obs == 6
+        assert np.array_equal(ls_ds[5]["X"], np.array([4, 5, 8, 0, 0, 0]))
+    state_path.unlink()
+    # the state of a collection is keyed on the hashes of the artifacts
+    hashes = [artifact.hash for artifact in collection_outer.artifacts.all()]
+    with ln.core.MappedCollection(
+        collection_outer.cache(),
+        obs_keys="feat1",
+        join="outer",
+        state_path=state_path,
+        hash_list=hashes,
+    ) as ls_ds:
+        state_key = ls_ds._state_key(hashes, "outer", True)
+    with state_path.open("rb") as f:
+        assert pickle.load(f)["key"] == state_key
+    # an unreadable state is recomputed
+    state_path.write_bytes(b"not a state")
+    with ln.core.MappedCollection(
+        collection_outer.cache(), obs_keys="feat1", join="outer", state_path=state_path
+    ) as ls_ds:
+        assert ls_ds.var_joint.equals(var_joint)
+    with state_path.open("rb") as f:
+        assert "var_joint" in pickle.load(f)
+    state_path.unlink()
+    with pytest.raises(ValueError):
+        ln.core.MappedCollection(
+            collection_outer.cache(), state_path="s3://bucket/mapped_state.pkl"
+        )
+
     artifact1.delete(permanent=True, storage=True)
     artifact2.delete(permanent=True, storage=True)
     artifact3.delete(permanent=True, storage=True)
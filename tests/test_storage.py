@@ -7,7 +7,11 @@ import numpy as np
 import pandas as pd
 import pytest
 import zarr
-from lamindb.core.storage._backed_access import BackedAccessor, backed_access
+from lamindb.core.storage._backed_access import (
+    BackedAccessor,
+    backed_access,
+    registry,
+)
 from lamindb.core.storage._zarr import read_adata_zarr, write_adata_zarr
 from lamindb.core.storage.objects import infer_suffix, write_to_disk
 from lamindb.core.storage.paths import read_adata_h5ad
@@ -134,12 +138,47 @@ def test_backed_access(adata_format):
         sub = access[:10]
         assert sub[:5].shape == (5, 200)
         assert sub.layers["test"].shape == sub.shape
+        # the names are read lazily
+        assert "_obs_names" not in access.__dict__
+        assert sub.obs_names.equals(access.obs_names[:10])
     assert access.closed
 
     with backed_access(fp, using_key=None) as access:
         idx = np.array([3, 1, 2])
         assert access[:, idx].to_memory().shape == (30, 3)
         assert access[idx].to_memory().shape == (3, 200)
+        # scattered rows with repetitions are read with coalesced slices
+        adata = read_adata_h5ad(ln.core.datasets.anndata_file_pbmc68k_test())
+        idx = np.array([20, 1, 20, 7])
+        sub = access[idx]
+        for X, X_ref in ((sub.X, adata.X), (sub.layers["test"], adata.layers["test"])):
+            X = X.toarray() if hasattr(X, "toarray") else X
+            X_ref = X_ref.toarray() if hasattr(X_ref, "toarray") else X_ref
+            assert np.array_equal(X, X_ref[idx])
+        assert sub.obs.index.tolist() == adata.obs_names[idx].tolist()
+        # a scalar column has the shape (n,) for dense arrays and (n, 1) for csr
+        for name in ("X", "layers/test"):
+            X = registry.safer_read_partial(access.storage[name], indices=(idx, 3))
+            X_ref = adata.X if name == "X" else adata.layers["test"]
+            X_ref = X_ref.toarray() if hasattr(X_ref, "toarray") else X_ref
+            if hasattr(X, "toarray"):
+                assert X.shape == (len(idx), 1)
+                X = X.toarray()[:, 0]
+            assert np.array_equal(X, X_ref[idx, 3])
+        adata_sub = access[:10].to_memory(slots=["X", "obsm"], max_workers=2)
+        assert adata_sub.obs_names.tolist() == adata.obs_names[:10].tolist()
+        assert list(adata_sub.obsm) == ["X_pca"]
+        assert len(adata_sub.layers) == 0
+        with pytest.raises(ValueError):
+            access.to_dict(slots=["Y"])
+        # only the requested columns are read
+        columns = adata.obs.columns[:2].tolist()[::-1]
+        df = access[idx].obs_columns(columns)
+        assert df.columns.tolist() == columns
+        assert df.index.tolist() == adata.obs_names[idx].tolist()
+        assert df[columns[0]].tolist() == adata.obs[columns[0]].iloc[idx].tolist()
+        assert access.obs_columns(columns[0]).shape == (30, 1)
+        assert "obs" not in access.__dict__
 
     if adata_format == "zarr":
         assert fp.suffix == ".zarr"
@@ -194,3 +233,60 @@ def test_backed_zarr_not_adata():
     assert access.storage["test"][...] == "test"
 
     shutil.rmtree(zarr_pth)
+
+
+def test_block_cached_file():
+    from fsspec.implementations.local import LocalFileSystem
+    from lamindb.core.storage._block_cache import BlockCachedFile
+
+    fp = ln.core.datasets.anndata_file_pbmc68k_test()
+    fs = LocalFileSystem()
+    with h5py.File(fp, mode="r") as file:
+        X = file["X"][:5]
+    conn = BlockCachedFile(fs, fp.as_posix(), block_size=2**16, readahead=2)
+    with h5py.File(conn, mode="r") as file:
+        assert np.array_equal(file["X"][:5], X)
+    assert 0 < conn.n_requests < conn.size // 2**16
+    # the blocks are cached
+    conn = BlockCachedFile(fs, fp.as_posix(), block_size=2**16, readahead=2)
+    with h5py.File(conn, mode="r") as file:
+        assert np.array_equal(file["X"][:5], X)
+    assert conn.n_requests == 0
+
+
+def test_block_cache_persist():
+    from fsspec.implementations.local import LocalFileSystem
+    from lamindb.core.storage._block_cache import BlockCachedFile, block_cache
+
+    fp = ln.core.datasets.anndata_file_pbmc68k_test()
+    backed = ln.settings.backed
+    backed.persist, backed.max_disk_bytes = True, 2**18
+    try:
+        conn = BlockCachedFile(LocalFileSystem(), fp.as_posix(), block_size=2**15)
+        with h5py.File(conn, mode="r") as file:
+            file["X"][:]
+    finally:
+        backed.persist, backed.max_disk_bytes = False, 2**32
+    # the least recently used blocks are removed from the cache directory
+    nbytes = sum(path.stat().st_size for path in block_cache._cache_dir().glob("*/*"))
+    assert 0 < nbytes <= 2**18
+
+
+def test_block_cached_store(tmp_path):
+    import os
+
+    from fsspec.implementations.local import LocalFileSystem
+    from lamindb.core.storage._block_cache import BlockCachedStore
+
+    path = (tmp_path / "store.zarr").as_posix()
+    root = zarr.open_group(path, mode="w")
+    root.create_dataset("x", data=np.arange(10), chunks=5)
+    store = BlockCachedStore(path, fs=LocalFileSystem())
+    assert np.array_equal(zarr.open_group(store, mode="r")["x"][:], np.arange(10))
+    # the cached chunks of a rewritten array are not used
+    root.create_dataset("x", data=np.arange(10, 20), chunks=5, overwrite=True)
+    zarray_path = tmp_path / "store.zarr" / "x" / ".zarray"
+    mtime = zarray_path.stat().st_mtime + 10
+    os.utime(zarray_path, (mtime, mtime))
+    store = BlockCachedStore(path, fs=LocalFileSystem())
+    assert np.array_equal(zarr.open_group(store, mode="r")["x"][:], np.arange(10, 20))